@@ -6,126 +6,164 @@ Adaptation of the A* algorithm.
 from math import sqrt
 
 from agents.base import Agent
+from agents.parallel_planner import ParallelPlanner
+from agents.path_finder import get_path_finder
+from environment.body import Body
 from utils.direction import DIR, turn_left, turn_right
+from utils.pos import Pos
 
 
 class AStar(Agent):
     __slots__ = {
         'training', 'last_score', 'tag',
-        'refresh_rate', 'recalculate', 'path_remainder'
+        'refresh_rate', 'recalculate', 'path_remainder',
+        'n_workers', 'pool',
     }
     
     def __init__(self,
-                 refresh_rate=10
+                 refresh_rate=10,
+                 n_workers=0,
                  ):
         """
         Initialisation of the Agent which handles via an adaptation of the A* algorithm.
         
         :param refresh_rate: Number of steps before recalculation of new A* path
+        :param n_workers: Number of worker processes that plan the paths in parallel, 0 plans serially
         """
         super().__init__(tag='a_star')
         self.refresh_rate = refresh_rate  # Number of steps before recalculation
         self.recalculate = None  # Timer until recalculation
         self.path_remainder = None
+        self.n_workers: int = n_workers  # Number of planning processes
+        self.pool: ParallelPlanner = None  # Pool of planning processes, created on reset
     
     def __str__(self):
         return f"AStar(\n" \
                f"\trefresh_rate={self.refresh_rate}\n" \
                f"\trecalculate={self.recalculate}\n" \
+               f"\tn_workers={self.n_workers}\n" \
                f")"
     
-    def __call__(self, games):
+    def __call__(self, games, envs=None):
         """
         Define the 'most suitable action' (as defined by the policy) for each of the games.
         
         :param games: List of games, each in a certain state
+        :param envs: Indices of the environments the games belong to, all environments in order if None
         :return: List of actions, where each action is either 0 (straight), 1 (left), or 2 (right)
         """
         if self.recalculate is None: raise Exception("Initialise first via 'reset'")
+        if envs is None: envs = range(len(games))
+        if self.pool is not None: self.plan_parallel(games, envs)
         
         # Loop over all the inputs to decide on each corresponding action
         actions = []
-        for i in range(len(games)):
-            # Parse message of requested game
-            game = games[i]
-            
-            # Previous apple was eaten, reset
-            if game.score > self.last_score[i]:
-                self.last_score[i] = game.score
-                self.recalculate[i] = 0
-            
-            # Recalculate a new path
-            body = game.snake.body
-            start = body[0]
-            if self.recalculate[i] <= 0:
-                self.recalculate[i] = self.refresh_rate
-                try:
-                    self.path_remainder[i] = a_star(start=start, goal=game.apple, dim=game.dim, body=body)
-                except ValueError:  # If no path is found, get random neighbour
-                    neighbours = get_neighbours(pos=start, goal=game.apple, dim=game.dim, body=body)
-                    self.recalculate[i] = 0
-                    if len(neighbours) == 0:  # We dead..
-                        actions.append(0)
-                        continue
-                    min_n = min(neighbours)
-                    self.path_remainder[i] = [min_n[1]]
-            
-            # Translate next position to an action and return this action
-            if len(self.path_remainder[i]) == 0:  # We dead..
+        for game, i in zip(games, envs):
+            # Get the next position of the snake's head
+            next_pos = self.get_next(game, i)
+            if next_pos is None:  # We dead..
                 actions.append(0)
                 continue
-            next_pos = self.path_remainder[i][0]
+            
+            # Translate next position to an action and return this action
+            start = game.snake.body[0]
             action = 0  # Straight by default
             if (start + turn_left(game.snake.direction)) == next_pos: action = 1  # Turn left
             if (start + turn_right(game.snake.direction)) == next_pos: action = 2  # Turn right
-            
-            # Progress one step internally
-            self.path_remainder[i] = self.path_remainder[i][1:]
-            self.recalculate[i] -= 1
             actions.append(action)
         return actions
     
-    def reset(self, n_envs, sample_game):
-        super().reset(n_envs=n_envs, sample_game=sample_game)
+    def get_next(self, game, i):
+        """Get the next position on the (periodically recalculated) A* path of the i'th environment."""
+        # Previous apple was eaten, reset
+        if game.score > self.last_score[i]:
+            self.last_score[i] = game.score
+            self.recalculate[i] = 0
+        
+        # Recalculate a new path
+        body = game.snake.body
+        start = body[0]
+        if self.recalculate[i] <= 0:
+            self.recalculate[i] = self.refresh_rate
+            try:
+                self.path_remainder[i] = a_star(start=start, goal=game.apple, dim=game.dim, body=body)
+            except ValueError:  # If no path is found, get random neighbour
+                self.recalculate[i] = 0
+                self.path_remainder[i] = self.get_fallback(game)
+        if len(self.path_remainder[i]) == 0: return None
+        
+        # Progress one step internally
+        next_pos = self.path_remainder[i][0]
+        self.path_remainder[i] = self.path_remainder[i][1:]
+        self.recalculate[i] -= 1
+        return next_pos
+    
+    def plan_parallel(self, games, envs):
+        """Recalculate the paths of all the environments that need a new path at once, sharded over the pool."""
+        # Previous apple was eaten or the path has run out, collect these environments
+        todo = []
+        for game, i in zip(games, envs):
+            if game.score > self.last_score[i]:
+                self.last_score[i] = game.score
+                self.recalculate[i] = 0
+            if self.recalculate[i] <= 0: todo.append((game, i))
+        if not todo: return
+        
+        # Plan all the paths, the occupancy grids are shared with the workers
+        height = todo[0][0].height
+        lengths, paths = self.pool(starts=[g.snake.body[0].flat(height) for g, _ in todo],
+                                   goals=[g.apple.flat(height) for g, _ in todo],
+                                   occupied=[g.snake.body.occupied for g, _ in todo])
+        for (game, i), length, path in zip(todo, lengths.tolist(), paths):
+            if length < 0:  # If no path is found, get random neighbour and search again on the next step
+                self.recalculate[i] = 1
+                self.path_remainder[i] = self.get_fallback(game)
+            else:
+                self.recalculate[i] = self.refresh_rate
+                self.path_remainder[i] = [Pos.from_flat(c, height) for c in path[:length].tolist()]
+    
+    @staticmethod
+    def get_fallback(game):
+        """Get the valid neighbour closest to the apple, as a path of length one (empty if no valid neighbours)."""
+        neighbours = get_neighbours(pos=game.snake.body[0], goal=game.apple, dim=game.dim, body=game.snake.body)
+        if len(neighbours) == 0: return []
+        return [min(neighbours)[1]]
+    
+    def reset(self, n_envs, sample_game, max_steps=None):
+        super().reset(n_envs=n_envs, sample_game=sample_game, max_steps=max_steps)
         self.recalculate = [0] * n_envs
         self.path_remainder = [[], ] * n_envs
+        
+        # (Re)start the planning processes if the shared memory doesn't fit the environments
+        if self.n_workers > 0 and sample_game is not None:
+            if self.pool is not None and (self.pool.dim != sample_game.dim or self.pool.capacity < n_envs):
+                self.pool.close()
+                self.pool = None
+            if self.pool is None:
+                self.pool = ParallelPlanner(dim=sample_game.dim, capacity=n_envs, n_workers=self.n_workers)
+    
+    def reset_env(self, i):
+        super().reset_env(i)
+        self.recalculate[i] = 0
+        self.path_remainder[i] = []
 
 
 def a_star(start, goal, dim, body):
-    """The A* algorithm: https://en.wikipedia.org/wiki/A*_search_algorithm"""
-    # Set of searched positions
-    searched = set()
-    
-    # Set of positions to be searched
-    exploring = {(distance(start, goal), start), }
-    
-    # Keep a dictionary indicating which positions came from which
-    cameFrom = dict()
-    
-    # Perform the calculation
-    found = False
-    while not found:
-        # Get the position closest to the goal that needs to be explored
-        temp = min(exploring)
-        dist, pos = temp
-        if dist == 0:
-            found = True
-            continue
-        searched.add(pos)
-        exploring.remove(temp)
-        
-        # Fetch all its neighbours
-        neighbours = get_neighbours(pos=pos, goal=goal, dim=dim, body=body)
-        for n in neighbours:
-            if n[1] in searched: continue  # Dead positions aren't searched again
-            if n[1] not in cameFrom: cameFrom[n[1]] = pos
-            exploring.add(n)
+    """
+    The A* algorithm: https://en.wikipedia.org/wiki/A*_search_algorithm
     
-    # Reconstruct the path
-    path = [goal]
-    while cameFrom[path[0]] != start:
-        path.insert(0, cameFrom[path[0]])
-    return path
+    :param start: Start position, typically the snake's head
+    :param goal: Goal position, typically the apple
+    :param dim: Dimension of the board (width, height)
+    :param body: Snake body, each of its segments is considered as an obstacle
+    :return: List of positions leading from start (excluded) to goal (included)
+    :raises ValueError: If no path is found
+    """
+    search = get_path_finder(dim)
+    occupied = body.occupied if isinstance(body, Body) else search.to_occupied(body)
+    return [Pos.from_flat(c, search.height) for c in search(start=start.flat(search.height),
+                                                            goal=goal.flat(search.height),
+                                                            occupied=occupied)]
 
 
 def get_neighbours(pos, goal, dim, body):
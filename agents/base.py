@@ -27,20 +27,29 @@ class Agent:
     def __str__(self):
         return f"Agent()"
     
-    def __call__(self, games):
+    def __call__(self, games, envs=None):
         """
         Call the agent to determine the next best action given a certain game state.
         
         :param games: List of games, each in a certain state
+        :param envs: Indices of the environments the games belong to, all environments in order if None
         :return: Action, which is either 0 (straight), 1 (left), or 2 (right)
         """
         raise NotImplementedError
     
-    def reset(self, n_envs, sample_game):
-        """Reset the agent to prepare for new evaluation."""
+    def reset(self, n_envs, sample_game, max_steps=None):
+        """Reset the agent to prepare for new evaluation, max_steps bounds the steps played by each environment."""
         self.last_score = [0] * n_envs
     
-    def train(self, duration, max_duration):
+    def reset_env(self, i):
+        """Reset the agent's state of the i'th environment, which has started a new game."""
+        self.last_score[i] = 0
+    
+    def end_step(self):
+        """Signal that all the environments have progressed by one step, after the agent was queried on each of them."""
+        pass
+    
+    def train(self, duration, max_duration, died=None, won=None):
         """Train the agent."""
         warn("Nothing is trained")
         return None
@@ -0,0 +1,130 @@
+"""
+bfs.py
+
+Greedy agent that follows the shortest path to the apple, found via a breadth-first search over all games at once.
+"""
+import numpy as np
+
+from agents.base import Agent
+from environment.observation import get_games_state
+from environment.vec_game import ACTION_TURN, DIR_OFFSET
+from utils.direction import DIR
+
+
+class BFS(Agent):
+    __slots__ = {
+        'training', 'last_score', 'tag',
+    }
+    
+    def __init__(self):
+        """Initialisation of the Agent which moves towards the apple via the shortest path in each of the games."""
+        super().__init__(tag='bfs')
+    
+    def __str__(self):
+        return "BFS()"
+    
+    def __call__(self, games, envs=None):
+        """
+        Define the 'most suitable action' for each of the games via a single batched search.
+        
+        :param games: List of games, each in a certain state, or a VecGame
+        :param envs: Indices of the environments the games belong to, unused since the agent is stateless
+        :return: List of actions, where each action is either 0 (straight), 1 (left), or 2 (right)
+        """
+        boards, heads, directions, apples = get_games_state(games)
+        return get_expert_actions(free=boards[..., 0] != -1, heads=heads, directions=directions, apples=apples).tolist()
+
+
+def get_distance_fields(free, sources, targets=None):
+    """
+    Compute the shortest-path distance from the sources to every cell, for all games in one vectorised wavefront.
+    
+    :param free: Boolean array (N, width, height) of the cells that can be traversed
+    :param sources: Boolean array (N, width, height) of the source cells, these don't need to be free
+    :param targets: Optional boolean array (N, width, height), stop as soon as each game has reached one of its targets
+    :return: Integer array (N, width, height) of distances, -1 for the unreachable (or not yet reached) cells
+    """
+    # Work on the flattened boards, walls surround the board hence shifted cells never wrap around to a free cell
+    n, width, height = free.shape
+    dist = np.full((n, width * height), -1, dtype=np.int32)
+    frontier = sources.reshape(n, -1).copy()
+    np.copyto(dist, 0, where=frontier)
+    unreached = free.reshape(n, -1) & ~frontier  # Free cells that aren't reached yet
+    pending = None if targets is None else targets.any(axis=(1, 2))  # Games that haven't reached a target yet
+    targets = None if targets is None else targets.reshape(n, -1)
+    grown = np.empty_like(frontier)
+    d = 0
+    while True:
+        # Grow the frontier by one cell in each direction
+        grown[:] = False
+        grown[:, 1:] |= frontier[:, :-1]
+        grown[:, :-1] |= frontier[:, 1:]
+        grown[:, height:] |= frontier[:, :-height]
+        grown[:, :-height] |= frontier[:, height:]
+        
+        # Only keep the free cells that weren't reached before
+        np.logical_and(grown, unreached, out=frontier)
+        if not frontier.any(): break
+        d += 1
+        np.copyto(dist, d, where=frontier)
+        unreached ^= frontier
+        
+        # Stop early if all the games have reached a target
+        if pending is not None:
+            pending &= ~(frontier & targets).any(axis=1)
+            if not pending.any(): break
+    return dist.reshape(free.shape)
+
+
+def get_expert_actions(free, heads, directions, apples):
+    """
+    Get for each game the action leading along the shortest path to its apple. If the apple can't be reached, a free
+    neighbour is chosen (straight if possible).
+    
+    :param free: Boolean array (N, width, height) of the cells that can be traversed, walls and body are obstacles
+    :param heads: Array of shape (N, 2) with the position of each snake's head
+    :param directions: Array of shape (N,) with the index in DIR of each snake's heading
+    :param apples: Array of shape (N, 2) with the position of each apple
+    :return: Array of shape (N,) with actions, each either 0 (straight), 1 (left), or 2 (right)
+    """
+    rows = np.arange(len(free))
+    apples = np.asarray(apples)
+    cx, cy, valid = get_candidates(free=free, heads=heads, directions=directions)
+    
+    # Distance to the apple from each of these cells, the search stops once the closest of them is reached
+    sources = np.zeros(free.shape, dtype=bool)
+    sources[rows, apples[:, 0], apples[:, 1]] = True
+    targets = np.zeros(free.shape, dtype=bool)
+    targets[rows[:, None], cx, cy] = valid
+    d = get_distance_fields(free=free, sources=sources, targets=targets)[rows[:, None], cx, cy]
+    return get_closest_actions(d=d, valid=valid)
+
+
+def get_candidates(free, heads, directions):
+    """
+    Get for each game the cells reached by each of the actions, and whether these can be entered.
+    
+    :param free: Boolean array (N, width, height) of the cells that can be traversed, walls and body are obstacles
+    :param heads: Array of shape (N, 2) with the position of each snake's head
+    :param directions: Array of shape (N,) with the index in DIR of each snake's heading
+    :return: Tuple of arrays of shape (N, 3), ordered like the actions: x and y of the reached cells, and a boolean
+             indicating if the reached cell is free
+    """
+    heads = np.asarray(heads)
+    candidates = heads[:, None, :] + DIR_OFFSET[(np.asarray(directions)[:, None] + ACTION_TURN[None, :]) % len(DIR)]
+    cx, cy = candidates[..., 0], candidates[..., 1]
+    return cx, cy, free[np.arange(len(heads))[:, None], cx, cy]
+
+
+def get_closest_actions(d, valid):
+    """
+    Get for each game the action leading closest to its apple. Reachable apples are preferred, then free cells, the
+    first (straight) action wins ties.
+    
+    :param d: Integer array (N, 3) with the distance from each action's cell to the apple, -1 if unreachable
+    :param valid: Boolean array (N, 3) indicating if each action's cell is free
+    :return: Array of shape (N,) with actions, each either 0 (straight), 1 (left), or 2 (right)
+    """
+    unreachable = d.max(initial=0) + 1  # Costlier than any reachable apple
+    cost = np.where(valid & (d >= 0), d, np.where(valid, unreachable, 2 * unreachable))
+    return cost.argmin(axis=1)
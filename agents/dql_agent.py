@@ -4,22 +4,27 @@ dql_agent.py
 Agent which is trained using the Deep Q-Learning approach.
 https://en.wikipedia.org/wiki/Q-learning
 """
-from random import choice, random
+import os
 
 import numpy as np
 import tensorflow as tf
 
-from agents.a_star import AStar
 from agents.base import Agent
-from models.handler import create_model
+from agents.experience import ExperienceBuffer
+from agents.expert import ExpertOracle
+from agents.replay import PrioritizedReplay
+from environment.observation import get_games_relative
+from models.checkpoint import CheckpointWriter, load_weights
+from models.handler import create_model, get_inference
+from models.trainer import Trainer
 
 
 class DeepQLearning(Agent):
     __slots__ = {
         'training', 'last_score', 'tag',
-        'model', 'model_t', 'model_v',
-        'states_mem', 'actions_mem', 'd_scores_mem',
-        'gamma', 'lr', 'eps', 'eps_decay', 'eps_max', 'eps_min', 'a_star_ratio',
+        'model', 'model_t', 'model_v', 'infer', 'trainer', 'batch_size', 'accumulate', 'states_buf',
+        'memory', 'episode', 'n_episodes', 'replay', 'replay_size', 'model_target', 'target_sync', 'n_updates',
+        'gamma', 'lr', 'eps', 'eps_decay', 'eps_max', 'eps_min', 'a_star_ratio', 'expert', 'checkpoints',
     }
     
     def __init__(self,
@@ -30,7 +35,13 @@ class DeepQLearning(Agent):
                  lr: float = 0.05,
                  eps_decay: float = 0.98,
                  eps_max: float = 0.4,
-                 eps_min: float = 0.1
+                 eps_min: float = 0.1,
+                 batch_size: int = 32,
+                 accumulate: int = 1,
+                 replay_size: int = 0,
+                 target_sync: int = 0,
+                 n_updates: int = 0,
+                 keep_checkpoints: int = 5,
                  ):
         """
         Initialisation of the Deep Q-Learning agent.
@@ -43,16 +54,35 @@ class DeepQLearning(Agent):
         :param eps_decay: Decaying factor of the action randomisation epsilon
         :param eps_max: Maximum (initial) value for the action randomisation epsilon
         :param eps_min: Minimum value for the action randomisation epsilon
+        :param batch_size: Number of samples in each of the training minibatches
+        :param accumulate: Number of minibatches of which the gradients are accumulated before updating the model
+        :param replay_size: Capacity of the prioritized replay memory kept over the training sessions, 0 to only train
+                            on the experience of the current session
+        :param target_sync: Number of model updates after which the target network is synced, 0 to train on the
+                            discounted scores of the episodes instead of bootstrapping from a target network
+        :param n_updates: Number of minibatches trained on each training session, 0 for a single pass over the samples
+        :param keep_checkpoints: Number of epoch checkpoints that are kept, older ones are removed
         """
         super().__init__(training=training, tag='dql')
         self.model = None  # Policy used to query actions given a state
+        self.infer = None  # Compiled inference call of the model, returns the most likely actions
+        self.trainer: Trainer = None  # Compiled training step of the model
+        self.batch_size: int = batch_size  # Size of the training minibatches
+        self.accumulate: int = accumulate  # Number of minibatches per model update
         self.model_t = model_type  # Type of policy used (mlp, cnn)
         self.model_v = model_v  # Version number of the model, 0 is non-versioned
+        self.states_buf = None  # Preallocated buffer for the queried states, padded to a power of two
+        self.checkpoints: CheckpointWriter = CheckpointWriter(keep=keep_checkpoints)  # Writes the weights in background
         
         # Training
-        self.states_mem: list = None  # Keeps the memorised states
-        self.actions_mem: list = None  # Keeps the memorised actions
-        self.d_scores_mem: list = None  # Keeps the memorised delta scores
+        self.memory: ExperienceBuffer = None  # Keeps the memorised states, actions, delta scores, and episodes
+        self.episode = None  # Episode currently played in each of the environments
+        self.n_episodes: int = 0  # Number of episodes started, episodes are numbered in the order they're started
+        self.replay: PrioritizedReplay = None  # Keeps the experience over the training sessions, if replay_size > 0
+        self.replay_size: int = replay_size  # Capacity of the replay memory
+        self.model_target = None  # Periodically synced copy of the model, provides the bootstrapped Q-values
+        self.target_sync: int = target_sync  # Number of model updates between target network syncs, 0 if not used
+        self.n_updates: int = n_updates  # Number of minibatches per training session, 0 for a single pass
         
         # DQL specific
         self.gamma: float = gamma  # Decaying factor to discount the scores
@@ -61,7 +91,8 @@ class DeepQLearning(Agent):
         self.eps_decay: float = eps_decay  # Decaying factor of the randomisation epsilon
         self.eps_max: float = eps_max  # Maximum value of the randomisation epsilon
         self.eps_min: float = eps_min  # Minimum value of the randomisation epsilon
-        self.a_star_ratio: float = 0.8  # Ratio of using A* when action is overwritten
+        self.a_star_ratio: float = 0.8  # Ratio of using the expert when action is overwritten
+        self.expert: ExpertOracle = ExpertOracle()  # Provides the shortest-path actions when the expert is used
     
     def __str__(self):
         return f"DeepQLearning(\n" \
@@ -74,189 +105,371 @@ class DeepQLearning(Agent):
                f"\tmin(epsilon)={self.eps_min}\n" \
                f"\tdecay(epsilon)={self.eps_decay}\n" \
                f"\ta_star_ratio={self.a_star_ratio}\n" \
+               f"\tbatch_size={self.batch_size}\n" \
+               f"\taccumulate={self.accumulate}\n" \
+               f"\treplay_size={self.replay_size}\n" \
+               f"\ttarget_sync={self.target_sync}\n" \
+               f"\tn_updates={self.n_updates}\n" \
+               f"\tkeep_checkpoints={self.checkpoints.keep}\n" \
                f")"
     
-    def __call__(self, games):
+    def __call__(self, games, envs=None):
         """
         Define the 'most suitable action' (as defined by the policy) for each of the games.
         
-        :param games: List of games, each in a certain state
+        :param games: List of games, each in a certain state, or a VecGame
+        :param envs: Indices of the environments the games belong to, all environments in order if None
         :return: List of actions, where each action is either 0 (straight), 1 (left), or 2 (right)
         """
         if self.model is None: raise Exception("Initialise first via 'reset'")
         
         if self.training:
-            return self.query_and_remember(games=games)
+            return self.query_and_remember(games=games, envs=envs)
         else:
             return self.query(games=games)
     
-    def reset(self, n_envs, sample_game):
-        super().reset(n_envs=n_envs, sample_game=sample_game)
-        if not self.model and not self.load_model(): self.create_model(sample_game.get_board_relative().shape)
+    def reset(self, n_envs, sample_game, max_steps=None):
+        super().reset(n_envs=n_envs, sample_game=sample_game, max_steps=max_steps)
+        shape = sample_game.get_board_relative().shape
+        if not self.model and not self.load_model(input_dim=shape): self.create_model(shape)
+        self.last_score = np.zeros((n_envs,))
         self.eps = self.eps_max
-        self.states_mem = []
-        self.actions_mem = []
-        self.d_scores_mem = []
+        
+        # Each environment plays at most max_steps steps, which bounds the memory needed during a training session
+        if self.training:
+            if max_steps is None: raise Exception("Maximum number of steps is required to size the memory")
+            capacity = n_envs * max_steps
+            if self.memory is None or self.memory.capacity != capacity or self.memory.states.shape[1:] != shape:
+                self.memory = ExperienceBuffer(capacity=capacity, state_shape=shape)
+            else:
+                self.memory.clear()
+            
+            # The replay memory persists over the training sessions, as long as its configuration is unchanged
+            transitions = self.target_sync > 0
+            if self.replay_size == 0:
+                self.replay = None
+            elif self.replay is None or self.replay.capacity != self.replay_size or \
+                    self.replay.states.shape[1:] != shape or (self.replay.next_states is not None) != transitions:
+                self.replay = PrioritizedReplay(capacity=self.replay_size, state_shape=shape, transitions=transitions)
+            
+            # The target network starts off as a copy of the model
+            if transitions and self.model_target is None:
+                self.model_target = tf.keras.models.clone_model(self.model)
+                self.sync_target()
+        self.episode = np.arange(n_envs)
+        self.n_episodes = n_envs
+        self.expert.reset(n_envs=n_envs)
+    
+    def reset_env(self, i):
+        super().reset_env(i)
+        self.expert.reset_env(i)
+        self.episode[i] = self.n_episodes
+        self.n_episodes += 1
     
     def query(self, games):
         """Query for actions, do not memorise seen states. Only used for evaluation."""
-        # Fetch all the states from the given messages
-        states = np.asarray([g.get_board_relative() for g in games])
+        # Fetch all the states from the given messages, written into the preallocated buffer
+        _, padded = self.get_states(games)
         
-        # Fetch the actions using the model
-        predictions = self.model.predict(states)
+        # Fetch the most likely actions using the compiled model, the padded states are ignored
+        return self.infer(padded).numpy()[:len(games)].tolist()
+    
+    def get_states(self, games):
+        """
+        Write the states of the games into the preallocated buffer. The states are padded up to the next power of two,
+        such that the compiled inference only sees a few distinct batch shapes.
         
-        # Parse actions from predictions (choose most likely actions)
-        return [np.argmax(p) for p in predictions]
+        :param games: Games of which the states are fetched
+        :return: Tuple: the states (view on the buffer), and these states together with the padding
+        """
+        n = len(games)
+        size = 1 << (n - 1).bit_length()
+        buf = self.states_buf
+        if buf is None or len(buf) < size:
+            states = get_games_relative(games)
+            buf = self.states_buf = np.zeros((size,) + states.shape[1:], dtype=states.dtype)
+            buf[:n] = states
+        else:
+            get_games_relative(games, out=buf[:n])
+        return buf[:n], buf[:size]
     
-    def query_and_remember(self, games):
+    def query_and_remember(self, games, envs=None):
         """
         Query for actions and remember both states and actions to use them as training data later on.
         
         :param games: Games for which predictions are made
+        :param envs: Indices of the environments the games belong to, all environments in order if None
         :return: Actions together with a boolean indicating if the action was randomised
         """
-        # Fetch all the states from the given messages
-        states = np.asarray([g.get_board_relative() for g in games])
-        self.states_mem.append(states)
+        envs = np.arange(len(games)) if envs is None else np.asarray(envs)
+        
+        # Fetch all the states from the given messages, and write these straight into the memory
+        states, padded = self.get_states(games)
+        rows = self.memory.reserve(len(games))
+        self.memory.states[rows] = states
+        self.memory.episodes[rows] = self.episode[envs]
         
         # Fetch received scores
-        scores = np.asarray([g.score for g in games])
-        d_scores = [scores[i] - self.last_score[i] for i in range(len(scores))]
-        self.last_score = scores
-        self.d_scores_mem.append(d_scores)
-        
-        # Fetch the actions using the model
-        predictions = self.model.predict(states)
-        
-        # Parse actions from predictions (choose most likely actions)
-        actions = [(np.argmax(p), False) for p in predictions]
-        
-        # Randomise fraction epsilon of the actions, and decay the epsilon afterwards
-        a_star = AStar()
-        a_star.reset(n_envs=1, sample_game=None)
-        for i in range(len(actions)):
-            if random() < self.eps:
-                if random() < self.a_star_ratio:  # Empirically chosen
-                    a_star.recalculate = [0]
-                    actions[i] = (a_star([games[i]])[0], False)  # Ask the A* algorithm for the most suitable action
-                else:
-                    actions[i] = (choice([0, 1, 2]), True)  # Perform a randomised action
-        self.eps = max(self.eps * self.eps_decay, self.eps_min)
-        
-        # Remember and return the chosen actions
-        self.actions_mem.append([a[0] for a in actions])
-        return actions
+        scores = np.asarray([g.score for g in games]) if isinstance(games, list) else games.score
+        self.memory.d_scores[rows] = scores - self.last_score[envs]
+        self.last_score[envs] = scores
+        
+        # Fetch the most likely actions using the compiled model
+        actions = self.infer(padded).numpy()[:len(games)]
+        
+        # Overwrite fraction epsilon of the actions, the epsilon decays once all the environments are stepped
+        overwrite = np.random.random(len(actions)) < self.eps
+        expert = overwrite & (np.random.random(len(actions)) < self.a_star_ratio)  # Empirically chosen
+        randomised = overwrite & ~expert
+        if expert.any(): actions[expert] = self.expert(games, envs=envs, mask=expert)  # Single batched expert call
+        actions[randomised] = np.random.randint(3, size=randomised.sum())  # Perform randomised actions
+        
+        # Remember and return the chosen actions, together with a boolean indicating if the action was randomised
+        self.memory.actions[rows] = actions
+        return list(zip(actions.tolist(), randomised.tolist()))
+    
+    def end_step(self):
+        """Decay the randomisation epsilon, once for each step of the environments."""
+        if self.training: self.eps = max(self.eps * self.eps_decay, self.eps_min)
     
     def create_model(self, input_dim):
         self.model = create_model(model_tag=self.model_t, input_dim=input_dim)
+        self.infer = get_inference(self.model)
+        self.trainer = Trainer(self.model)
         self.model.summary()
     
-    def train(self, duration, max_duration: int = 100, score_adj: bool = True):
+    def train(self, duration, max_duration: int = 100, died=None, won=None, score_adj: bool = True):
         """
-        Train the model with the memorised data. Each game is trained sequentially since length of states doesn't
-        necessarily coincide.
+        Train the model with the memorised data. The targets of all the episodes are constructed at once, even though
+        their lengths don't necessarily coincide.
         
-        :param duration: Indicates duration of each simulation
+        :param duration: Indicates duration of each episode, in the order in which the episodes were started
         :param max_duration: Maximum duration of the simulation
+        :param died: Indicates for each episode if it ended by dying, derived from its duration if None
+        :param won: Indicates for each episode if it ended by filling the complete board, none of them if None
         :param score_adj: Adjust the score (shift to right) to match (state, action) pairs
         """
-        assert self.states_mem is not None and self.actions_mem is not None and self.d_scores_mem is not None
-        assert len(self.states_mem) == len(self.actions_mem) == len(self.d_scores_mem)
-        assert len(self.states_mem[0]) == len(duration)  # Equal number of environments
-        assert len(self.states_mem) == max(duration)  # Equal number of environments
+        assert self.memory is not None
+        assert len(duration) == self.n_episodes  # Equal number of episodes
+        if died is None: died = [d < max_duration for d in duration]
+        if won is None: won = [False] * len(duration)
+        
+        # Group the memorised steps by episode, a stable sort keeps the steps of each episode in chronological order
+        states_mem, actions_mem, d_scores_mem, episodes_mem = self.memory.get()
+        order = np.argsort(episodes_mem, kind='stable')
+        actions_mem, d_scores_mem = actions_mem[order], d_scores_mem[order]
+        offsets = np.concatenate([[0], np.cumsum(duration)])
+        assert offsets[-1] == len(states_mem)  # Each step belongs to exactly one episode
+        
+        # Episode of each of the steps, together with the number of steps until the last step of its episode
+        duration = np.asarray(duration)
+        episode = np.repeat(np.arange(len(duration)), duration)
+        back = offsets[1:][episode] - 1 - np.arange(len(episode))
+        
+        # Rewards of all the episodes at once, these are stored episode after episode
+        rewards = d_scores_mem.astype(np.float32)
+        if score_adj:
+            rewards[:-1] = rewards[1:]
+            found = np.bincount(episode, weights=np.where(back > 0, rewards, 0), minlength=len(duration)) > 0
+            rewards[offsets[1:] - 1] = np.select(
+                    [np.asarray(won), ~np.asarray(died) & found, ~np.asarray(died)],
+                    [.5, 0, -.1],  # Filled the board, never died and found an apple in its lifetime, or never found one
+                    -1,  # Last action was invalid move; punish
+            )
+        
+        # Bootstrap from the target network instead of discounting the episodes
+        if self.target_sync > 0: return self.train_off_policy(order=order, actions=actions_mem, rewards=rewards,
+                                                              ends=offsets[1:] - 1, died=died, won=won)
         
         # Collect all the last states to discount (single prediction, increases speed)
-        last_states = []
-        for i_env, d in enumerate(duration): last_states.append(self.states_mem[d - 1][i_env])
-        q_values_last_state = self.model.predict(np.asarray(last_states))
-        
-        # Iterate over each of the environments to collect all the training data: inputs (states) and outputs (q-values)
-        states = []
-        q_values = []
-        for i_env, d in enumerate(duration):
-            scores = [s[i_env] for s in self.d_scores_mem[:d]]
-            if score_adj:
-                scores = scores[1:]
-                if d == max_duration and sum(scores) > 0:  # Never died and found at least one apple in its lifetime
-                    scores.append(0)
-                elif d == max_duration:
-                    scores.append(-.1)  # Never found apple, but didn't die
-                else:
-                    scores.append(-1)  # Last action was invalid move; punish
-            
-            # Discount the scores
-            discounted_scores = self.discount(scores, last_q_value=q_values_last_state[i_env])
-            
-            # Train
-            states_temp = []
-            for t in range(d):
-                # Ignore all entries with negligible discounted scores
-                if abs(discounted_scores[t]) <= 1e-2: continue
-                
-                # Get the state to add to the dataset
-                states_temp.append(self.states_mem[t][i_env])
-            
-            # Make predictions
-            q_values_temp = self.model.predict(np.asarray(states_temp))
-            
-            # Decay the Q-values with the learning rate
-            q_values_temp *= (1 - self.lr)
-            
-            # Update the Q-values with the calculated discounted scores
-            i = 0
-            for t in range(d):
-                # Ignore all entries with negligible discounted scores
-                if abs(discounted_scores[t]) <= 1e-2: continue
-                
-                # Increase the action-chosen Q-value with discounted_score * lr
-                q = q_values_temp[i][self.actions_mem[t][i_env]]
-                q_values_temp[i][self.actions_mem[t][i_env]] = min(max(q + self.lr * discounted_scores[t], 0), 1)
-                i += 1
+        last_states = tf.cast(states_mem[order[offsets[1:] - 1]], tf.float32)
+        q_values_last_state = self.model(last_states, training=False).numpy()
+        
+        # Discount the rewards, ignore all entries with negligible discounted scores
+        discounted_scores = self.discount(rewards, back=back, last_q_values=q_values_last_state)
+        keep = np.abs(discounted_scores) > 1e-2
+        if self.replay is not None:
+            self.replay.add(states=states_mem[order[keep]], actions=actions_mem[keep], returns=discounted_scores[keep])
+        
+        # Nothing to train on if none of the steps are kept and nothing can be replayed, the metrics are left empty
+        if not keep.any() and (self.replay is None or len(self.replay) == 0): return self.trainer(batches=())
+        
+        # Stream the kept steps from the memory, or replay as many prioritised samples from the replay memory to which
+        # the kept steps are added
+        if self.replay is None:
+            dataset = self.memory.stream(rows=order[keep], columns=(actions_mem[keep], discounted_scores[keep]),
+                                         batch_size=self.batch_size, n_batches=self.n_updates or None)
+        else:
+            dataset = self.replay.stream(n_batches=self.n_updates or -(-keep.sum() // self.batch_size),
+                                         batch_size=self.batch_size)
+        dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+        
+        # Train the model, the targets of each minibatch are built by the train step itself
+        metrics = self.trainer(dataset, accumulate=self.accumulate, targets=self.get_targets, params=(self.lr,),
+                               priorities=self.replay.update if self.replay is not None else None)
+        self.save_model()
+        return metrics
+    
+    def get_targets(self, q_values, actions, discounted_scores, lr):
+        """
+        Build the Q-value targets of a minibatch, as part of the compiled train step.
+        
+        :param q_values: Q-values predicted by the model for the minibatch's states
+        :param actions: Action chosen in each of the states
+        :param discounted_scores: Discounted score received after each of the actions
+        :param lr: Learning rate, passed as a tensor such that changes in between the training sessions are picked up
+        :return: Tuple: the target Q-values of the states, and the one-hot encoding of the chosen actions
+        """
+        # Decay the Q-values with the learning rate
+        q_values = q_values * (1 - lr)
+        
+        # Increase the action-chosen Q-value with discounted_score * lr
+        chosen = tf.one_hot(tf.cast(actions, tf.int32), depth=q_values.shape[-1])
+        q = tf.reduce_sum(q_values * chosen, axis=1) + lr * discounted_scores
+        return q_values * (1 - chosen) + tf.clip_by_value(q, 0, 1)[:, None] * chosen, chosen
+    
+    def train_off_policy(self, order, actions, rewards, ends, died, won):
+        """
+        Train the model on the memorised transitions via Q-learning, bootstrapping from the target network. Many small
+        minibatches are sampled from the transitions, the target network is synced every target_sync updates.
+        
+        :param order: Rows of the memorised steps, episode after episode in chronological order
+        :param actions: Action chosen in each of the steps
+        :param rewards: Reward received for each of the actions
+        :param ends: Index of the last step of each episode
+        :param died: Indicates for each episode if it ended by dying
+        :param won: Indicates for each episode if it ended by filling the complete board
+        """
+        # The next state of a step is the next stored step, the last step of an episode is followed by itself
+        following = np.arange(1, len(order) + 1)
+        following[ends] = ends
+        dones = np.zeros(len(order), dtype=bool)
+        dones[ends] = np.asarray(died) | np.asarray(won)  # Both dying and filling the board end the episode
+        
+        # Add the transitions to the replay memory and replay from there, or stream uniformly sampled transitions
+        states_mem = self.memory.states
+        if self.replay is not None:
+            metrics = self.learn(states=states_mem[order], actions=actions, rewards=rewards, dones=dones,
+                                 next_states=states_mem[order[following]])
+        else:
+            dataset = self.memory.stream(rows=order, columns=(actions, rewards, dones), next_rows=order[following],
+                                         batch_size=self.batch_size,
+                                         n_batches=self.n_updates or -(-len(order) // self.batch_size))
+            dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
             
-            # Add the data
-            states += states_temp
-            q_values += q_values_temp.tolist()
-        
-        # Train the model
-        history = self.model.fit(
-                x=np.asarray(states),
-                y=np.asarray(q_values),
-                epochs=1,
-                verbose=0,
-        )
+            # Train the model, the target network is only synced in between the train steps that bootstrap from it
+            metrics = self.trainer(dataset, accumulate=self.accumulate, targets=self.get_q_targets,
+                                   params=(self.gamma,), on_update=self.sync_target)
         self.save_model()
-        return history.history['loss'][0]
+        return metrics
     
-    def discount(self, scores, last_q_value=None):
-        """Discount the received rewards."""
+    def learn(self, states, actions, rewards, dones, next_states):
+        """
+        Add the transitions to the replay memory, and train on prioritised minibatches replayed from it. Transitions
+        may be gathered elsewhere (e.g. by actor processes), hence both the replay memory and the target network are
+        created if these don't exist yet.
+        
+        :param states: States of the transitions, int8
+        :param actions: Action chosen in each of the states
+        :param rewards: Reward received for each of the actions
+        :param dones: Indicates if the episode ended by each of the actions
+        :param next_states: State reached by each of the actions, int8
+        :return: Dictionary of training metrics
+        """
+        if self.replay is None or self.replay.next_states is None:
+            self.replay = PrioritizedReplay(capacity=self.replay_size, state_shape=states.shape[1:], transitions=True)
+        if self.model_target is None:
+            self.model_target = tf.keras.models.clone_model(self.model)
+            self.sync_target()
+        self.replay.add(states=states, actions=actions, returns=rewards, dones=dones, next_states=next_states)
+        dataset = self.replay.stream(n_batches=self.n_updates or -(-len(states) // self.batch_size),
+                                     batch_size=self.batch_size)
+        dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+        
+        # Train the model, the target network is only synced in between the train steps that bootstrap from it
+        return self.trainer(dataset, accumulate=self.accumulate, targets=self.get_q_targets, params=(self.gamma,),
+                            priorities=self.replay.update, on_update=self.sync_target)
+    
+    def get_q_targets(self, q_values, actions, rewards, dones, next_states, gamma):
+        """
+        Build the Q-learning targets of a minibatch of transitions, as part of the compiled train step.
+        
+        :param q_values: Q-values predicted by the model for the minibatch's states
+        :param actions: Action chosen in each of the states
+        :param rewards: Reward received for each of the actions
+        :param dones: Indicates if the episode ended by each of the actions
+        :param next_states: State reached by each of the actions, int8
+        :param gamma: Discount factor, passed as a tensor such that it always matches the one used by discount
+        :return: Tuple: the target Q-values of the states, and the one-hot encoding of the chosen actions
+        """
+        # Reward of the chosen action, together with the discounted maximal Q-value of the next state
+        q_next = tf.reduce_max(self.model_target(tf.cast(next_states, tf.float32), training=False), axis=1)
+        q = rewards + gamma * q_next * (1 - tf.cast(dones, tf.float32))
+        chosen = tf.one_hot(tf.cast(actions, tf.int32), depth=q_values.shape[-1])
+        return q_values * (1 - chosen) + tf.clip_by_value(q, 0, 1)[:, None] * chosen, chosen
+    
+    def sync_target(self, updates=0):
+        """Copy the model's weights into the target network, once every target_sync updates."""
+        if updates % self.target_sync == 0: self.model_target.set_weights(self.model.get_weights())
+    
+    def discount(self, rewards, back, last_q_values=None):
+        """
+        Discount the received rewards of all the episodes at once, going backwards in time over all episodes together.
+        
+        :param rewards: Rewards of all the steps, stored episode after episode in chronological order
+        :param back: Number of steps between each step and the last step of its episode
+        :param last_q_values: Q-values of the last state of each episode, used as initial cumulative reward
+        :return: Discounted rewards
+        """
+        # Steps sorted on their distance to the end of the episode, the steps of each distance form a contiguous block
+        order = np.argsort(back, kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(back))])
+        
         # The initial cumulative reward will be the discounted maximal Q-value of the current (last) state
-        cum_r = self.gamma * np.max(last_q_value) if last_q_value is not None else 0
+        discounted = np.zeros_like(rewards, dtype=np.float32)
+        last = order[bounds[0]:bounds[1]]
+        cum_r = self.gamma * np.max(last_q_values, axis=1) if last_q_values is not None else 0
+        discounted[last] = rewards[last] + self.gamma * cum_r
         
-        # Discount all the rewards in reverse order (for efficiency)
-        discounted = np.zeros_like(scores, dtype=np.float32)
-        for t in reversed(range(0, len(scores))):
-            cum_r = scores[t] + self.gamma * cum_r
-            discounted[t] = cum_r
+        # Discount all the rewards in reverse order, the next step of each episode is always the next stored step
+        for lo, hi in zip(bounds[1:-1], bounds[2:]):
+            steps = order[lo:hi]
+            discounted[steps] = rewards[steps] + self.gamma * discounted[steps + 1]
         return discounted
     
     def save_model(self, model_name: str = None, epoch: int = None):
-        """Save the current model in the 'models' folder found under root."""
+        """
+        Checkpoint the current weights in the 'models' folder found under root. The weights are written in the
+        background, only the last keep_checkpoints epoch checkpoints are kept.
+        """
         if self.model_v == 0: return  # Unversioned models aren't saved/loaded
         if not model_name:
             model_name = f'{self.model_t}_{self.model_v}'
             if epoch is not None: model_name += f'_e{epoch}'
-        self.model.save(f"models/dql/{model_name}")
-        # print("==> Model saved successfully!")
+        self.checkpoints.save(self.model, path=f"models/dql/{model_name}.npz", rotate=epoch is not None)
     
-    def load_model(self, model_name: str = None, epoch: int = None):
-        """Load the model, return boolean indicating if model loaded successfully or not."""
+    def load_model(self, model_name: str = None, epoch: int = None, input_dim=None):
+        """
+        Load the model, return boolean indicating if model loaded successfully or not. A weights checkpoint is preferred
+        if the input dimension is known, otherwise a complete (SavedModel) model is loaded.
+        """
         if self.model_v == 0: return False  # Unversioned models aren't saved/loaded
         if not model_name:
             model_name = f"{self.model_t}_{self.model_v}"
             if epoch is not None: model_name += f'_e{epoch}'
+        path = f"models/dql/{model_name}"
         try:
-            self.model = tf.keras.models.load_model(f"models/dql/{model_name}")
+            self.checkpoints.flush()  # Pending checkpoints are written first
+            if input_dim is not None and os.path.isfile(f"{path}.npz"):
+                model = create_model(model_tag=self.model_t, input_dim=input_dim)
+                model.set_weights(load_weights(f"{path}.npz"))
+                self.model = model
+            elif os.path.exists(path):
+                self.model = tf.keras.models.load_model(path)
+            else:
+                return False
+            self.infer = get_inference(self.model)
+            self.trainer = Trainer(self.model)
             self.model.summary()
             print("==> Model loaded successfully!")
             return True
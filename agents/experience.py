@@ -0,0 +1,105 @@
+"""
+experience.py
+
+Preallocated ring buffer holding the experience (states, actions, rewards) gathered while playing.
+"""
+import numpy as np
+import tensorflow as tf
+
+
+class ExperienceBuffer:
+    __slots__ = {
+        'capacity', 'states', 'actions', 'd_scores', 'episodes', 'ptr', 'size',
+    }
+    
+    def __init__(self, capacity, state_shape):
+        """
+        Buffer of fixed capacity, once full the oldest steps are overwritten. Boards only hold -1, 0, and 1, hence the
+        states are stored as int8.
+        
+        :param capacity: Maximum number of steps kept
+        :param state_shape: Shape of a single state
+        """
+        self.capacity: int = capacity
+        self.states = np.zeros((capacity,) + tuple(state_shape), dtype=np.int8)  # Observed state of each step
+        self.actions = np.zeros((capacity,), dtype=np.int8)  # Action chosen in each step
+        self.d_scores = np.zeros((capacity,), dtype=np.float32)  # Score received since the previous step
+        self.episodes = np.zeros((capacity,), dtype=np.int32)  # Episode to which each step belongs
+        self.ptr: int = 0  # Row to which the next step is written
+        self.size: int = 0  # Number of rows in use
+    
+    def __str__(self):
+        return f"ExperienceBuffer(size={self.size}, capacity={self.capacity})"
+    
+    def __len__(self):
+        return self.size
+    
+    def clear(self):
+        """Forget all the steps, the memory is kept."""
+        self.ptr = 0
+        self.size = 0
+    
+    def reserve(self, n):
+        """
+        Claim the rows to which the next n steps are written.
+        
+        :param n: Number of steps
+        :return: Slice over the rows, or an array of row indices if the rows wrap around the end of the buffer
+        """
+        assert n <= self.capacity
+        start = self.ptr
+        self.ptr = (start + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+        if start + n <= self.capacity: return slice(start, start + n)
+        return np.arange(start, start + n) % self.capacity
+    
+    def get(self):
+        """
+        Get all the steps in the order in which they were written. These are views on the buffer, unless the buffer
+        has wrapped around.
+        
+        :return: Tuple: states, actions, d_scores, episodes
+        """
+        if self.size < self.capacity or self.ptr == 0:
+            rows = slice(0, self.size)
+        else:
+            rows = np.roll(np.arange(self.capacity), -self.ptr)
+        return self.states[rows], self.actions[rows], self.d_scores[rows], self.episodes[rows]
+    
+    def stream(self, rows, columns=(), batch_size: int = 32, next_rows=None, n_batches=None):
+        """
+        Create a streaming pipeline over the given rows of the buffer. The rows are shuffled and the minibatches are
+        gathered from the buffer one at a time, hence only the batches in flight are held in memory next to the buffer.
+        
+        :param rows: Rows of the buffer that are streamed
+        :param columns: Additional arrays, aligned with the rows, that are batched together with the states
+        :param batch_size: Number of samples in each minibatch
+        :param next_rows: Optional rows of the states that follow the streamed rows, batched after the columns
+        :param n_batches: Number of minibatches sampled uniformly (with replacement), a single pass if None
+        :return: Dataset of tuples (states, *columns) or (states, *columns, next_states), the states remain int8
+        """
+        rows = np.asarray(rows)
+        columns = [np.asarray(c) for c in columns]
+        dtypes = [tf.int8] + [tf.as_dtype(c.dtype) for c in columns]
+        shapes = [self.states.shape[1:]] + [c.shape[1:] for c in columns]
+        if next_rows is not None:
+            next_rows = np.asarray(next_rows)
+            dtypes.append(tf.int8)
+            shapes.append(self.states.shape[1:])
+        
+        def gather(idx):
+            batch = [self.states[rows[idx]]] + [c[idx] for c in columns]
+            if next_rows is not None: batch.append(self.states[next_rows[idx]])
+            return batch
+        
+        def load(idx):
+            batch = tf.numpy_function(gather, [idx], dtypes)
+            for b, shape in zip(batch, shapes): b.set_shape((None,) + tuple(shape))
+            return tuple(batch)
+        
+        if n_batches is not None:
+            dataset = tf.data.Dataset.range(n_batches).map(
+                    lambda _: tf.random.uniform((batch_size,), maxval=len(rows), dtype=tf.int64))
+            return dataset.map(load)
+        dataset = tf.data.Dataset.range(len(rows)).shuffle(len(rows), reshuffle_each_iteration=True)
+        return dataset.batch(batch_size).map(load)
@@ -0,0 +1,88 @@
+"""
+expert.py
+
+Expert oracle that provides the actions along the shortest path to the apple, for many games in one batched call.
+"""
+import numpy as np
+
+from agents.bfs import get_candidates, get_closest_actions, get_distance_fields
+from environment.observation import get_games_state
+
+
+class ExpertOracle:
+    __slots__ = {
+        'refresh_rate', 'fields', 'apples', 'age',
+    }
+    
+    def __init__(self, refresh_rate=10):
+        """
+        Oracle that keeps, for each environment, the distance field towards its apple. A field is reused as long as the
+        apple doesn't move and the snake is still on one of its shortest paths, so only the diverged environments need
+        a new (batched) search.
+        
+        :param refresh_rate: Maximum number of queries before the field of an environment is recalculated
+        """
+        self.refresh_rate: int = refresh_rate  # Number of queries before recalculation
+        self.fields = None  # Distance towards the apple for each environment's cells, -1 if unknown
+        self.apples = None  # Apple position for which each of the fields was calculated
+        self.age = None  # Number of queries since each of the fields was calculated
+    
+    def __str__(self):
+        return f"ExpertOracle(refresh_rate={self.refresh_rate})"
+    
+    def __call__(self, games, envs, mask=None):
+        """
+        Get the expert action for each of the selected games.
+        
+        :param games: List of games, each in a certain state, or a VecGame
+        :param envs: Indices of the environments the games belong to
+        :param mask: Optional boolean array selecting the games that need an expert action, all games if None
+        :return: Array of actions for the selected games, each either 0 (straight), 1 (left), or 2 (right)
+        """
+        envs = np.asarray(envs)
+        if mask is None: mask = np.ones(len(envs), dtype=bool)
+        if isinstance(games, list): games = [g for g, m in zip(games, mask) if m]
+        boards, heads, directions, apples = get_games_state(games)
+        if not isinstance(games, list):  # VecGame, select the masked environments
+            boards, heads, directions, apples = boards[mask], heads[mask], directions[mask], apples[mask]
+        envs = envs[mask]
+        n, width, height, _ = boards.shape
+        rows = np.arange(n)
+        if self.fields.shape[1:] != (width, height):
+            self.fields = np.full((len(self.fields), width, height), -1, dtype=np.int32)
+        
+        # Cells reached by each of the actions
+        free = boards[..., 0] != -1
+        cx, cy, valid = get_candidates(free=free, heads=heads, directions=directions)
+        
+        # Reuse the fields of which the apple didn't move and that still lead the head one step closer to the apple
+        head_d = self.fields[envs, heads[:, 0], heads[:, 1]]
+        d = self.fields[envs[:, None], cx, cy]
+        reuse = (self.apples[envs] == apples).all(axis=1) & (self.age[envs] < self.refresh_rate) & (head_d > 0)
+        reuse &= (valid & (d == head_d[:, None] - 1)).any(axis=1)
+        
+        # Search all the other environments at once, stopping once the closest candidate is reached
+        replan = ~reuse
+        if replan.any():
+            r, e = rows[replan], envs[replan]
+            sources = np.zeros((len(r), width, height), dtype=bool)
+            sources[np.arange(len(r)), apples[r, 0], apples[r, 1]] = True
+            targets = np.zeros((len(r), width, height), dtype=bool)
+            targets[np.arange(len(r))[:, None], cx[r], cy[r]] = valid[r]
+            self.fields[e] = get_distance_fields(free=free[r], sources=sources, targets=targets)
+            self.apples[e] = apples[r]
+            self.age[e] = 0
+            d[r] = self.fields[e[:, None], cx[r], cy[r]]
+        self.age[envs] += 1
+        
+        return get_closest_actions(d=d, valid=valid)
+    
+    def reset(self, n_envs):
+        """Forget the fields of all the environments."""
+        self.fields = np.full((n_envs, 0, 0), -1, dtype=np.int32)  # Allocated once the board shape is known
+        self.apples = np.full((n_envs, 2), -1, dtype=np.int64)
+        self.age = np.full((n_envs,), self.refresh_rate, dtype=np.int64)
+    
+    def reset_env(self, i):
+        """Forget the field of the i'th environment, which has started a new game."""
+        self.age[i] = self.refresh_rate
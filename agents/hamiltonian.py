@@ -0,0 +1,162 @@
+"""
+hamiltonian.py
+
+Agent that follows a precomputed Hamiltonian cycle over the board, taking safe shortcuts towards the apple.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from agents.base import Agent
+from agents.bfs import get_candidates
+from environment.observation import get_games_state
+from utils.direction import DIR
+
+
+class Hamiltonian(Agent):
+    __slots__ = {
+        'training', 'last_score', 'tag',
+        'shortcuts',
+    }
+    
+    def __init__(self,
+                 shortcuts=True,
+                 ):
+        """
+        Initialisation of the Agent which follows a Hamiltonian cycle over the board, without any search.
+        
+        :param shortcuts: Take shortcuts towards the apple when these can't trap the snake
+        """
+        super().__init__(tag='hamiltonian')
+        self.shortcuts: bool = shortcuts  # Allow shortcuts
+    
+    def __str__(self):
+        return f"Hamiltonian(\n" \
+               f"\tshortcuts={self.shortcuts}\n" \
+               f")"
+    
+    def __call__(self, games, envs=None):
+        """
+        Define the 'most suitable action' for each of the games via table lookups.
+        
+        :param games: List of games, each in a certain state, or a VecGame
+        :param envs: Indices of the environments the games belong to, unused since the agent is stateless
+        :return: List of actions, where each action is either 0 (straight), 1 (left), or 2 (right)
+        """
+        boards, heads, directions, apples = get_games_state(games)
+        if isinstance(games, list):
+            tails = np.asarray([g.snake.body.cells[-1] for g in games])
+            lengths = np.asarray([len(g.snake.body) for g in games])
+        else:
+            tails, lengths = games.get_tail(), games.length
+        return get_cycle_actions(free=boards[..., 0] != -1, heads=heads, directions=directions, apples=apples,
+                                 tails=tails, lengths=lengths, shortcuts=self.shortcuts).tolist()
+
+
+def get_cycle(width, height):
+    """
+    Create a Hamiltonian cycle over a grid. Grids with an odd number of cells have no such cycle, in which case the top
+    left cell is left out.
+    
+    :param width: Width of the grid
+    :param height: Height of the grid
+    :return: List of (x, y) positions, each consecutive pair (last and first included) being neighbours
+    """
+    if width % 2 == 0 and height % 2 == 1:  # Only the height may be odd, transpose otherwise
+        return [(x, y) for y, x in get_cycle(height, width)]
+    rows = height - height % 2  # Even number of rows covered by the standard cycle
+    
+    # Go right along the bottom row, zigzag over the remaining columns, and return via the leftmost column
+    cycle = [(x, 0) for x in range(width)]
+    for y in range(1, rows):
+        row = [(x, y) for x in (range(width - 1, 0, -1) if y % 2 == 1 else range(1, width))]
+        if y == rows - 1 and rows < height:  # Detour every pair of cells over the (odd) top row
+            row = [p for i in range(0, len(row), 2)
+                   for p in (row[i], (row[i][0], height - 1), (row[i + 1][0], height - 1), row[i + 1])]
+        cycle += row
+    cycle += [(0, y) for y in range(rows - 1, 0, -1)]
+    return cycle
+
+
+@lru_cache(maxsize=None)
+def get_cycle_tables(dim):
+    """
+    Create the lookup tables of the Hamiltonian cycle over the interior of the board.
+    
+    Each cell gets a position along the cycle, counted in half steps such that a cell that's left out of the cycle can
+    be spliced in between two of its neighbours. Following the cycle means moving to the next position.
+    
+    :param dim: Dimension of the board (width, height)
+    :return: Tuple: position of each flat cell (-1 for walls), next flat cell when following, cycle length in half steps
+    """
+    width, height = dim
+    cycle = [(x + 1) * height + (y + 1) for x, y in get_cycle(width - 2, height - 2)]
+    position = np.full((width * height,), -1, dtype=np.int64)
+    following = np.full((width * height,), -1, dtype=np.int64)
+    for i, c in enumerate(cycle):
+        position[c] = 2 * i
+        following[c] = cycle[(i + 1) % len(cycle)]
+    
+    # Splice a left out cell in between the two neighbours that are two cells apart on the cycle
+    for c in range(width * height):
+        x, y = divmod(c, height)
+        if position[c] >= 0 or not (0 < x < width - 1 and 0 < y < height - 1): continue
+        for dx, dy in DIR:
+            n = (x + dx) * height + (y + dy)
+            if position[n] >= 0 and position[following[following[n]]] == (position[n] + 4) % (2 * len(cycle)):
+                if any((x + ex) * height + (y + ey) == following[following[n]] for ex, ey in DIR):
+                    position[c] = position[n] + 1
+                    following[c] = following[following[n]]
+                    break
+    for table in (position, following): table.setflags(write=False)
+    return position, following, 2 * len(cycle)
+
+
+def get_cycle_actions(free, heads, directions, apples, tails, lengths, shortcuts=True):
+    """
+    Get for each game the action that follows the Hamiltonian cycle, or a safe shortcut along it towards the apple.
+    
+    A shortcut is only taken while the snake covers less than half the cycle, and if it leaves at least half the cycle
+    free between the new head and the tail. The body then stays ordered along the cycle and the free region ahead of
+    the head can't run out before the tail has caught up with the skipped cells.
+    
+    On boards with an odd number of cells, the cell left out of the cycle is entered when it holds the apple. Once the
+    snake can't grow otherwise it takes this last apple as well, such that each game ends instead of circling forever.
+    
+    :param free: Boolean array (N, width, height) of the cells that can be traversed, walls and body are obstacles
+    :param heads: Array of shape (N, 2) with the position of each snake's head
+    :param directions: Array of shape (N,) with the index in DIR of each snake's heading
+    :param apples: Array of shape (N, 2) with the position of each apple
+    :param tails: Array of shape (N,) with the flat index (x * height + y) of each snake's tail
+    :param lengths: Array of shape (N,) with the length of each snake
+    :param shortcuts: Allow shortcuts
+    :return: Array of shape (N,) with actions, each either 0 (straight), 1 (left), or 2 (right)
+    """
+    _, width, height = free.shape
+    position, following, m = get_cycle_tables((width, height))
+    heads, apples = np.asarray(heads), np.asarray(apples)
+    
+    # Cells reached by each of the actions
+    cx, cy, valid = get_candidates(free=free, heads=heads, directions=directions)
+    cells = cx * height + cy
+    pos = position[cells]
+    
+    # Distances along the cycle (in half steps) from the head to each candidate, and from these to the tail and apple
+    head_pos = position[heads[:, 0] * height + heads[:, 1]][:, None]
+    tail_pos = position[np.asarray(tails)][:, None]
+    ahead = valid & ((pos - head_pos) % m < (tail_pos - head_pos) % m)  # Candidate lies between head and tail
+    to_tail = (tail_pos - pos) % m
+    to_apple = (position[apples[:, 0] * height + apples[:, 1]][:, None] - pos) % m
+    
+    # Following the cycle, or entering a left out cell that holds the apple
+    follow = valid & (cells == following[heads[:, 0] * height + heads[:, 1]][:, None])
+    # Once the snake can't grow otherwise, the last apple is taken even if the body can't be completed afterwards
+    last = (np.asarray(lengths) + 2 >= (width - 2) * (height - 2))[:, None]
+    follow |= ahead & (pos % 2 == 1) & (to_apple == 0) & ((to_tail >= 5) | last)
+    cost = np.where(follow, 0, np.where(valid, 2 * m + to_apple, 4 * m))
+    
+    # Shortcuts are preferred over following the cycle, the one ending up closest to the apple is chosen
+    if shortcuts:
+        safe = ahead & (pos >= 0) & (2 * np.asarray(lengths) < m // 2)[:, None] & (to_tail >= m // 2 + 2)
+        cost = np.where(safe, -m + to_apple, cost)
+    return cost.argmin(axis=1)
@@ -0,0 +1,111 @@
+"""
+parallel_planner.py
+
+Pool of worker processes that plan A* paths for many games at once. The game state is handed to the workers through
+shared memory, and the paths are returned as compact arrays in that same shared memory.
+"""
+import weakref
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from agents.path_finder import get_path_finder
+from utils.shared import attach, get_context, get_layout
+
+# Shared arrays of the worker process, attached once by the pool's initialiser
+_worker = None
+
+
+class ParallelPlanner:
+    __slots__ = {
+        'dim', 'capacity', 'n_workers', 'shm', 'pool', '_finalizer', '__weakref__',
+    }
+    
+    def __init__(self, dim, capacity, n_workers):
+        """
+        Create the shared memory and start the worker processes.
+        
+        :param dim: Dimension of the board (width, height)
+        :param capacity: Maximum number of games planned in a single call
+        :param n_workers: Number of worker processes
+        """
+        self.dim = dim
+        self.capacity: int = capacity
+        self.n_workers: int = n_workers
+        
+        # A single shared block holds the input (occupancy, start and goal) and output (path and length) of each game,
+        # the array views are only created for the duration of a call such that the block can always be released
+        self.shm = SharedMemory(create=True, size=get_layout(get_arrays(dim, capacity))[1])
+        self.pool = get_context().Pool(processes=n_workers, initializer=init_worker,
+                                       initargs=(self.shm.name, dim, capacity))
+        self._finalizer = weakref.finalize(self, release, self.pool, self.shm)
+    
+    def __str__(self):
+        return f"ParallelPlanner(dim={self.dim}, capacity={self.capacity}, n_workers={self.n_workers})"
+    
+    def __call__(self, starts, goals, occupied):
+        """
+        Plan the shortest path for each of the games, sharded over the workers.
+        
+        :param starts: Flat index of each game's start cell
+        :param goals: Flat index of each game's goal cell
+        :param occupied: Occupancy grid of each game, a sequence of bytes-like objects of length width * height
+        :return: Tuple: lengths (N,) of the paths, -1 if no path was found, and paths (N, width * height) holding the
+                 flat indices leading from start (excluded) to goal (included)
+        """
+        n = len(starts)
+        assert n <= self.capacity
+        views = attach(self.shm.buf, get_arrays(self.dim, self.capacity))
+        shared_occupied, shared_starts, shared_goals, paths, lengths = views
+        shared_starts[:n] = starts
+        shared_goals[:n] = goals
+        for k, o in enumerate(occupied): shared_occupied[k] = np.frombuffer(o, dtype=np.uint8)
+        
+        # Several shards per worker balance the load, since searches differ a lot in duration
+        bounds = np.linspace(0, n, min(n, 4 * self.n_workers) + 1).astype(int)
+        self.pool.starmap(plan_shard, zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+        return lengths[:n].copy(), paths[:n].copy()
+    
+    def close(self):
+        """Stop the workers and release the shared memory."""
+        self._finalizer()
+
+
+def get_arrays(dim, capacity):
+    """Get the (dtype, shape) of each shared array: occupied, starts, goals, paths, lengths."""
+    cells = dim[0] * dim[1]
+    return [
+        (np.uint8, (capacity, cells)),  # occupied
+        (np.int32, (capacity,)),  # starts
+        (np.int32, (capacity,)),  # goals
+        (np.int16, (capacity, cells)),  # paths
+        (np.int16, (capacity,)),  # lengths
+    ]
+
+
+def init_worker(name, dim, capacity):
+    """Attach the worker process to the shared memory."""
+    global _worker
+    shm = SharedMemory(name=name)
+    _worker = (shm, get_path_finder(dim), *attach(shm.buf, get_arrays(dim, capacity)))
+
+
+def plan_shard(lo, hi):
+    """Plan the paths of the games lo up to hi, the results are written in the shared memory."""
+    _, search, occupied, starts, goals, paths, lengths = _worker
+    for k in range(lo, hi):
+        try:
+            path = search(start=int(starts[k]), goal=int(goals[k]), occupied=bytearray(occupied[k]))
+        except ValueError:  # No path found
+            lengths[k] = -1
+            continue
+        paths[k, :len(path)] = path
+        lengths[k] = len(path)
+
+
+def release(pool, shm):
+    """Terminate the pool and unlink the shared memory."""
+    pool.terminate()
+    pool.join()
+    shm.close()
+    shm.unlink()
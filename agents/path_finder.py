@@ -0,0 +1,92 @@
+"""
+path_finder.py
+
+Reusable A* search over the flattened cells of a board.
+"""
+from functools import lru_cache
+from heapq import heappop, heappush
+
+from utils.grid import get_neighbours_table
+
+
+@lru_cache(maxsize=None)
+def get_path_finder(dim):
+    """Get the (reused) path finder for boards of the given dimension."""
+    return PathFinder(width=dim[0], height=dim[1])
+
+
+class PathFinder:
+    __slots__ = {
+        'width', 'height', 'neighbours',
+        'g', 'came_from', 'seen', 'closed', 'generation',
+    }
+    
+    def __init__(self, width, height):
+        """
+        A* search over the flattened cells (x * height + y) of a board, using a binary heap as open list, path costs
+        combined with a Manhattan heuristic, and scratch arrays that are reused over the searches.
+        
+        :param width: Width of the board
+        :param height: Height of the board
+        """
+        self.width: int = width
+        self.height: int = height
+        
+        self.neighbours = get_neighbours_table((width, height))  # Neighbours of each cell, walls excluded
+        
+        # Scratch arrays, an entry is only valid if its stamp matches the generation of the current search
+        self.g = [0] * (width * height)  # Cost of the cheapest path found so far from start to each cell
+        self.came_from = [-1] * (width * height)  # Previous cell on the cheapest path
+        self.seen = [0] * (width * height)  # Generation in which g and came_from were last set
+        self.closed = [0] * (width * height)  # Generation in which the cell was expanded
+        self.generation: int = 0
+    
+    def __call__(self, start, goal, occupied):
+        """
+        Search the shortest path from start to goal.
+        
+        :param start: Flat index of the start cell
+        :param goal: Flat index of the goal cell
+        :param occupied: Occupancy grid (indexable by flat index) of the obstacles next to the walls
+        :return: List of flat cell indices leading from start (excluded) to goal (included)
+        :raises ValueError: If no path is found
+        """
+        self.generation += 1
+        gen, height = self.generation, self.height
+        g, came_from, seen, closed = self.g, self.came_from, self.seen, self.closed
+        gx, gy = divmod(goal, height)
+        
+        # Open list, sorted on estimated total cost, ties are broken by the lowest heuristic (deepest node)
+        h = abs(start // height - gx) + abs(start % height - gy)
+        heap = [(h, h, start)]
+        g[start], came_from[start], seen[start] = 0, -1, gen
+        while heap:
+            _, _, c = heappop(heap)
+            if c == goal: break
+            if closed[c] == gen: continue  # Stale entry of an already expanded cell
+            closed[c] = gen
+            
+            # Expand all the valid neighbours, walls are already excluded
+            g_n = g[c] + 1
+            for n in self.neighbours[c]:
+                if occupied[n] or closed[n] == gen: continue
+                if seen[n] == gen and g[n] <= g_n: continue
+                g[n], came_from[n], seen[n] = g_n, c, gen
+                h = abs(n // height - gx) + abs(n % height - gy)
+                heappush(heap, (g_n + h, h, n))
+        else:
+            raise ValueError("No path found")
+        
+        # Reconstruct the path
+        path = []
+        while c != start:
+            path.append(c)
+            c = came_from[c]
+        path.reverse()
+        return path
+    
+    def to_occupied(self, body):
+        """Create an occupancy grid for the given list of positions."""
+        occupied = bytearray(self.width * self.height)
+        for p in body: occupied[p[0] * self.height + p[1]] = 1
+        return occupied
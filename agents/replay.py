@@ -0,0 +1,171 @@
+"""
+replay.py
+
+Prioritized replay memory, which keeps the experience over multiple training sessions and samples it proportional to
+its error: https://arxiv.org/abs/1511.05952
+"""
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+
+class SumTree:
+    __slots__ = {
+        'leaves', 'depth', 'tree',
+    }
+    
+    def __init__(self, capacity):
+        """
+        Binary tree of which each node holds the sum of its children, stored as a flat array with the root at index 1.
+        Both updates and (proportional) sampling are O(log n), and vectorised over a batch of entries.
+        
+        :param capacity: Number of entries (leaves)
+        """
+        self.depth: int = max(capacity - 1, 0).bit_length()  # Number of levels below the root
+        self.leaves: int = 1 << self.depth  # Number of leaves, rounded up to a power of two
+        self.tree = np.zeros((2 * self.leaves,), dtype=np.float64)  # Children of node i are found at 2i and 2i + 1
+    
+    def __str__(self):
+        return f"SumTree(leaves={self.leaves}, total={self.total()})"
+    
+    def total(self):
+        """Sum of all the priorities."""
+        return self.tree[1]
+    
+    def get(self, idx):
+        """Get the priority of the given entries."""
+        return self.tree[np.asarray(idx) + self.leaves]
+    
+    def update(self, idx, priorities):
+        """
+        Set the priority of the given entries, and update the sums of all their ancestors.
+        
+        :param idx: Indices of the entries
+        :param priorities: Non-negative priority of each of the entries
+        """
+        nodes = np.asarray(idx) + self.leaves
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+    
+    def find(self, values):
+        """
+        Find the entries in which each of the values falls, when laying out the priorities one after the other.
+        
+        :param values: Values in the range [0, total)
+        :return: Indices of the entries
+        """
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(values.shape, dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            right = values >= self.tree[left]
+            values -= np.where(right, self.tree[left], 0)
+            nodes = left + right
+        return nodes - self.leaves
+
+
+class PrioritizedReplay:
+    __slots__ = {
+        'capacity', 'states', 'actions', 'returns', 'next_states', 'dones', 'tree', 'ptr', 'size', 'alpha', 'beta',
+        'max_priority', 'lock',
+    }
+    
+    def __init__(self, capacity, state_shape, alpha: float = 0.6, beta: float = 0.4, transitions: bool = False):
+        """
+        Replay memory of fixed capacity, once full the oldest samples are evicted. Each sample is a state, the action
+        chosen in it, and the discounted score (return) received afterwards. Transitions instead hold the reward of the
+        action, together with the next state and whether the episode ended.
+        
+        :param capacity: Maximum number of samples kept
+        :param state_shape: Shape of a single state
+        :param alpha: Degree of prioritisation, 0 samples uniformly
+        :param beta: Degree of importance sampling correction, 1 fully compensates the prioritisation
+        :param transitions: Keep transitions (state, action, reward, done, next state) instead of returns
+        """
+        self.capacity: int = capacity
+        self.states = np.zeros((capacity,) + tuple(state_shape), dtype=np.int8)  # States, stored as int8
+        self.actions = np.zeros((capacity,), dtype=np.int8)  # Action chosen in each state
+        self.returns = np.zeros((capacity,), dtype=np.float32)  # Discounted score (or reward) after each action
+        self.next_states = np.zeros_like(self.states) if transitions else None  # State reached by each action
+        self.dones = np.zeros((capacity,), dtype=bool) if transitions else None  # Indicates if the episode ended
+        self.tree: SumTree = SumTree(capacity)  # Priority of each sample
+        self.ptr: int = 0  # Row to which the next sample is written
+        self.size: int = 0  # Number of rows in use
+        self.alpha: float = alpha  # Prioritisation exponent
+        self.beta: float = beta  # Importance sampling exponent
+        self.max_priority: float = 1.  # New samples are replayed at least once with the highest priority
+        self.lock = threading.Lock()  # Guards the priorities, sampled by the streaming pipeline while being updated
+    
+    def __str__(self):
+        return f"PrioritizedReplay(size={self.size}, capacity={self.capacity}, alpha={self.alpha}, beta={self.beta})"
+    
+    def __len__(self):
+        return self.size
+    
+    def add(self, states, actions, returns, dones=None, next_states=None):
+        """Add the samples to the memory, evicting the oldest ones if the capacity is exceeded."""
+        n = min(len(states), self.capacity)  # Only the newest samples fit if these exceed the capacity
+        rows = np.arange(self.ptr, self.ptr + n) % self.capacity
+        with self.lock:
+            self.states[rows] = states[len(states) - n:]
+            self.actions[rows] = actions[len(actions) - n:]
+            self.returns[rows] = returns[len(returns) - n:]
+            if self.next_states is not None:
+                self.dones[rows] = dones[len(dones) - n:]
+                self.next_states[rows] = next_states[len(next_states) - n:]
+            self.tree.update(rows, self.max_priority)
+            self.ptr = (self.ptr + n) % self.capacity
+            self.size = min(self.size + n, self.capacity)
+    
+    def sample(self, n):
+        """
+        Sample proportional to the priorities, stratified over n equally sized segments of the total priority.
+        
+        :param n: Number of samples
+        :return: Tuple: rows of the samples, and their (normalised) importance sampling weights
+        """
+        with self.lock:
+            total = self.tree.total()
+            values = (np.arange(n) + np.random.random(n)) * (total / n)
+            rows = np.minimum(self.tree.find(np.minimum(values, np.nextafter(total, 0))), self.size - 1)
+            weights = (self.size * self.tree.get(rows) / total) ** -self.beta
+        return rows, (weights / weights.max()).astype(np.float32)
+    
+    def update(self, rows, errors):
+        """Update the priorities of the replayed samples with their new errors."""
+        priorities = (np.abs(errors) + 1e-3) ** self.alpha
+        with self.lock:
+            self.tree.update(rows, priorities)
+            self.max_priority = max(self.max_priority, float(priorities.max()))
+    
+    def stream(self, n_batches, batch_size: int = 32):
+        """
+        Create a streaming pipeline of prioritised minibatches. Each minibatch is sampled once it's requested, hence
+        it reflects the priorities updated by the preceding (all but the prefetched) minibatches.
+        
+        :param n_batches: Number of minibatches
+        :param batch_size: Number of samples in each minibatch
+        :return: Dataset of tuples (states, actions, returns, weights, rows), or (states, actions, rewards, dones,
+                 next_states, weights, rows) for transitions, the states remain int8
+        """
+        dtypes = [tf.int8, tf.int8, tf.float32, tf.float32, tf.int64]
+        shapes = [self.states.shape[1:], (), (), (), ()]
+        if self.next_states is not None:
+            dtypes[3:3] = [tf.bool, tf.int8]
+            shapes[3:3] = [(), self.states.shape[1:]]
+        
+        def gather(_):
+            rows, weights = self.sample(batch_size)
+            batch = [self.states[rows], self.actions[rows], self.returns[rows]]
+            if self.next_states is not None: batch += [self.dones[rows], self.next_states[rows]]
+            return batch + [weights, rows]
+        
+        def load(i):
+            batch = tf.numpy_function(gather, [i], dtypes)
+            for b, shape in zip(batch, shapes): b.set_shape((batch_size,) + tuple(shape))
+            return tuple(batch)
+        
+        return tf.data.Dataset.range(n_batches).map(load)
@@ -0,0 +1,260 @@
+"""
+actor_learner.py
+
+Asynchronous actor-learner training. Actor processes play the games with a recent copy of the policy and stream their
+transitions through shared memory to the learner, which trains on them and periodically republishes its weights.
+"""
+import os
+import queue
+import weakref
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from environment.game import Game
+from utils.shared import attach, get_context, get_layout
+
+
+class ActorLearner:
+    __slots__ = {
+        'agent', 'n_actors', 'n_envs', 'max_steps', 'chunk', 'n_slots', 'publish_rate', 'published', 'shape',
+        'weight_shapes', 'weights_shm', 'experience_shm', 'version', 'lock', 'stop', 'free', 'full', 'processes',
+        '_finalizer', '__weakref__',
+    }
+    
+    def __init__(self,
+                 agent,
+                 n_actors: int = None,
+                 n_envs: int = 1024,
+                 max_steps: int = 1000,
+                 chunk: int = 20,
+                 publish_rate: int = 10,
+                 ):
+        """
+        Start the actor processes, the calling process acts as the learner. Rollouts and training overlap, since the
+        actors keep on playing while the learner trains.
+        
+        :param agent: DeepQLearning agent, trained off-policy via its replay memory and target network
+        :param n_actors: Number of actor processes, all but one of the available cores if None
+        :param n_envs: Number of environments played by all actors together
+        :param max_steps: Maximum duration of an episode, longer episodes are cut off and restarted
+        :param chunk: Number of steps each actor plays before handing its transitions to the learner
+        :param publish_rate: Number of model updates after which the weights are republished to the actors
+        """
+        if agent.replay_size <= 0 or agent.target_sync <= 0:
+            raise Exception("Actor-learner training requires both the replay memory and the target network")
+        self.agent = agent
+        self.n_actors: int = n_actors or max((os.cpu_count() or 1) - 1, 1)
+        self.n_envs: int = max(n_envs // self.n_actors, 1)  # Number of environments of each actor
+        self.max_steps: int = max_steps
+        self.chunk: int = chunk
+        self.n_slots: int = 2 * self.n_actors  # Each actor can fill a slot while its previous one is being consumed
+        self.publish_rate: int = publish_rate
+        
+        # Make sure the model exists before its weights are published
+        self.shape = Game().get_board_relative().shape
+        if not agent.model and not agent.load_model(input_dim=self.shape): agent.create_model(self.shape)
+        self.weight_shapes = [w.shape for w in agent.model.get_weights()]
+        
+        # Shared memory holding the published weights, and the slots to which the actors write their transitions
+        arrays = get_arrays(self.shape, self.n_slots, self.chunk, self.n_envs)
+        self.weights_shm = SharedMemory(create=True, size=get_layout(get_weight_arrays(self.weight_shapes))[1])
+        self.experience_shm = SharedMemory(create=True, size=get_layout(arrays)[1])
+        
+        # Synchronisation between the learner and the actors
+        ctx = get_context()
+        self.version = ctx.Value('i', 0, lock=False)  # Version of the published weights, guarded by the lock
+        self.lock = ctx.Lock()
+        self.stop = ctx.Event()
+        self.free = ctx.Queue()  # Slots that can be filled by the actors
+        self.full = ctx.Queue()  # Slots filled by the actors, together with the results of their finished episodes
+        for slot in range(self.n_slots): self.free.put(slot)
+        self.published: int = 0  # Number of model updates at the last publication
+        self.publish()
+        
+        # Each actor explores with its own fixed epsilon, spread between the agent's maximum and minimum epsilon
+        self.processes = []
+        for rank, eps in enumerate(np.linspace(agent.eps_max, agent.eps_min, self.n_actors)):
+            process = ctx.Process(target=run_actor, daemon=True, kwargs={
+                'rank': rank,
+                'model_type': agent.model_t,
+                'shape': self.shape,
+                'weight_shapes': self.weight_shapes,
+                'n_slots': self.n_slots,
+                'chunk': self.chunk,
+                'n_envs': self.n_envs,
+                'max_steps': self.max_steps,
+                'eps': float(eps),
+                'a_star_ratio': agent.a_star_ratio,
+                'weights_name': self.weights_shm.name,
+                'experience_name': self.experience_shm.name,
+                'version': self.version,
+                'lock': self.lock,
+                'stop': self.stop,
+                'free': self.free,
+                'full': self.full,
+            })
+            process.start()
+            self.processes.append(process)
+        self._finalizer = weakref.finalize(self, release, self.stop, self.processes,
+                                           [self.weights_shm, self.experience_shm])
+    
+    def __str__(self):
+        return f"ActorLearner(n_actors={self.n_actors}, n_envs={self.n_envs}, chunk={self.chunk})"
+    
+    def __call__(self, n_steps):
+        """
+        Train on the transitions streamed by the actors, until n_steps transitions are consumed and at least one
+        episode has finished.
+        
+        :param n_steps: Number of transitions consumed
+        :return: Scores (per finished episode), durations (pe), snake-length (pe), training metrics
+        """
+        consumed, scores, durations, lengths, metrics = 0, [], [], [], []
+        while consumed < n_steps or not scores:
+            slot, results = self.get()
+            
+            # Copy the valid transitions out of the slot, after which the slot is handed back to the actors
+            arrays = get_arrays(self.shape, self.n_slots, self.chunk, self.n_envs)
+            states, actions, rewards, dones, valid = (a[slot] for a in attach(self.experience_shm.buf, arrays))
+            transitions = {
+                'states': states[:-1][valid],
+                'actions': actions[valid],
+                'rewards': rewards[valid],
+                'dones': dones[valid],
+                'next_states': states[1:][valid],
+            }
+            del states, actions, rewards, dones, valid  # Release the views on the shared memory
+            self.free.put(slot)
+            for s, d, l in results:
+                scores.append(s)
+                durations.append(d)
+                lengths.append(l)
+            
+            # Train, and republish the weights once enough updates are made
+            metrics.append(self.agent.learn(**transitions))
+            consumed += len(transitions['actions'])
+            if self.agent.trainer.updates - self.published >= self.publish_rate: self.publish()
+        return scores, durations, lengths, {k: float(np.mean([m[k] for m in metrics])) for k in metrics[0]}
+    
+    def get(self):
+        """Wait for a slot filled by one of the actors."""
+        while True:
+            try:
+                return self.full.get(timeout=1)
+            except queue.Empty:
+                if any(p.exitcode is not None for p in self.processes): raise Exception("An actor process has stopped")
+    
+    def publish(self):
+        """Write the current weights of the model to the shared memory, picked up by the actors at their next chunk."""
+        with self.lock:
+            views = attach(self.weights_shm.buf, get_weight_arrays(self.weight_shapes))
+            for view, w in zip(views, self.agent.model.get_weights()): view[:] = w
+            del views  # Release the views on the shared memory
+            self.version.value += 1
+        self.published = self.agent.trainer.updates
+    
+    def close(self):
+        """Stop the actors and release the shared memory."""
+        self._finalizer()
+
+
+def get_arrays(shape, n_slots, chunk, n_envs):
+    """Get the (dtype, shape) of each of the shared experience arrays: states, actions, rewards, dones, valid."""
+    return [
+        (np.int8, (n_slots, chunk + 1, n_envs) + tuple(shape)),  # states, including the last next state
+        (np.int8, (n_slots, chunk, n_envs)),  # actions
+        (np.float32, (n_slots, chunk, n_envs)),  # rewards
+        (bool, (n_slots, chunk, n_envs)),  # dones
+        (bool, (n_slots, chunk, n_envs)),  # valid, episodes cut off at max_steps have no next state
+    ]
+
+
+def get_weight_arrays(weight_shapes):
+    """Get the (dtype, shape) of each of the shared weights, one for each of the model's weights."""
+    return [(np.float32, s) for s in weight_shapes]
+
+
+def run_actor(rank, model_type, shape, weight_shapes, n_slots, chunk, n_envs, max_steps, eps, a_star_ratio,
+              weights_name, experience_name, version, lock, stop, free, full):
+    """Play the games with the latest published policy, and write the transitions to the free slots."""
+    import tensorflow as tf
+    
+    from agents.expert import ExpertOracle
+    from environment.vec_game import VecGame
+    from models.handler import create_model, get_inference
+    
+    # The actors share the cores with each other and the learner
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    np.random.seed((os.getpid() * 1000 + rank) % 2 ** 32)
+    weights_shm, experience_shm = SharedMemory(name=weights_name), SharedMemory(name=experience_name)
+    model = create_model(model_tag=model_type, input_dim=shape)
+    infer = get_inference(model)
+    games = VecGame(n_envs=n_envs)
+    expert = ExpertOracle()
+    expert.reset(n_envs=n_envs)
+    envs = np.arange(n_envs)
+    current = None  # Version of the weights used by the model
+    
+    try:
+        while not stop.is_set():
+            try:
+                slot = free.get(timeout=.1)
+            except queue.Empty:
+                continue
+            
+            # Pick up the latest published weights
+            if version.value != current:
+                with lock:
+                    model.set_weights([w.copy() for w in attach(weights_shm.buf, get_weight_arrays(weight_shapes))])
+                    current = version.value
+            
+            # Play a chunk of steps, the state reached by the last step is written as well
+            arrays = get_arrays(shape, n_slots, chunk, n_envs)
+            states, actions, rewards, dones, valid = (a[slot] for a in attach(experience_shm.buf, arrays))
+            results = []
+            games.get_board_relative(out=states[0])
+            for t in range(chunk):
+                a = infer(states[t]).numpy()
+                
+                # Overwrite fraction epsilon of the actions, either by the expert or randomly
+                overwrite = np.random.random(n_envs) < eps
+                use_expert = overwrite & (np.random.random(n_envs) < a_star_ratio)
+                randomised = overwrite & ~use_expert
+                if use_expert.any(): a[use_expert] = expert(games, envs=envs, mask=use_expert)
+                a[randomised] = np.random.randint(3, size=randomised.sum())
+                
+                # Progress the games, the reward is the score received by the action
+                alive, eaten, _ = games.step(a, randomised=randomised)
+                died = ~alive & ~games.won  # Snakes that filled the complete board end without dying
+                cut = alive & (games.steps >= max_steps)
+                actions[t] = a
+                rewards[t] = np.where(died, -1, .5 * eaten)
+                dones[t] = ~alive
+                valid[t] = ~cut
+                
+                # Record and restart the finished episodes
+                ended = ~alive | cut
+                if ended.any():
+                    idx = np.flatnonzero(ended)
+                    results += zip(games.score[idx].tolist(), games.steps[idx].tolist(), games.length[idx].tolist())
+                    games.reset(mask=ended)
+                    expert.reset_env(idx)
+                games.get_board_relative(out=states[t + 1])
+            del states, actions, rewards, dones, valid  # Release the views on the shared memory
+            full.put((slot, results))
+    finally:
+        weights_shm.close()
+        experience_shm.close()
+
+
+def release(stop, processes, shms):
+    """Stop the actor processes and unlink the shared memory."""
+    stop.set()
+    for p in processes:
+        p.join(timeout=5)
+        if p.exitcode is None: p.terminate()
+    for shm in shms:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,100 @@
+"""
+body.py
+
+Compact representation of the snake's body: a deque of flat cell indices together with an occupancy grid and an
+index of the free cells.
+"""
+from collections import deque
+from random import randrange
+
+from utils.pos import Pos
+
+
+class Body:
+    __slots__ = {
+        'height', 'cells', 'occupied', 'free', 'free_i',
+    }
+    
+    def __init__(self,
+                 width,
+                 height,
+                 ):
+        """
+        Body of the snake, sorted from head to tail, supporting constant time moves and collision checks.
+        
+        :param width: Width of the playing field
+        :param height: Height of the playing field
+        """
+        self.height: int = height  # Used to (de)flatten the cell indices
+        self.cells: deque = deque()  # Flat cell indices (x * height + y), sorted from head to tail
+        self.occupied: bytearray = bytearray(width * height)  # Occupancy grid of the flattened board
+        
+        # Unordered flat indices of all the free interior cells, together with each cell's index in this list
+        self.free: list = [x * height + y for x in range(1, width - 1) for y in range(1, height - 1)]
+        self.free_i: list = [-1] * (width * height)
+        for i, c in enumerate(self.free): self.free_i[c] = i
+    
+    def __str__(self):
+        return f"Body({list(self)})"
+    
+    def __repr__(self):
+        return str(self)
+    
+    def __len__(self):
+        return len(self.cells)
+    
+    def __contains__(self, pos):
+        """Check if the given position is occupied by the body."""
+        x, y = pos[0], pos[1]
+        if not (0 <= y < self.height): return False
+        c = x * self.height + y
+        return 0 <= c < len(self.occupied) and self.occupied[c] == 1
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice): return [self.to_pos(c) for c in list(self.cells)[i]]
+        return self.to_pos(self.cells[i])
+    
+    def __iter__(self):
+        for c in self.cells: yield self.to_pos(c)
+    
+    def __reversed__(self):
+        for c in reversed(self.cells): yield self.to_pos(c)
+    
+    def to_pos(self, c):
+        """Convert a flat cell index to its position."""
+        return Pos.from_flat(c, self.height)
+    
+    def clear(self):
+        """Remove all the segments of the body."""
+        for c in self.cells: self.release(c)
+        self.cells.clear()
+    
+    def add_head(self, pos):
+        """Add a new head to the body."""
+        c = pos[0] * self.height + pos[1]
+        self.cells.appendleft(c)
+        self.occupied[c] = 1
+        
+        # Swap-remove the cell from the free cells
+        i, last = self.free_i[c], self.free[-1]
+        self.free[i] = last
+        self.free_i[last] = i
+        self.free.pop()
+        self.free_i[c] = -1
+    
+    def remove_tail(self):
+        """Remove the tail of the body and return its position."""
+        c = self.cells.pop()
+        self.release(c)
+        return self.to_pos(c)
+    
+    def release(self, c):
+        """Mark the given flat cell index as free."""
+        self.occupied[c] = 0
+        self.free_i[c] = len(self.free)
+        self.free.append(c)
+    
+    def random_free(self):
+        """Get a uniformly random free interior position, None if the body fills all the interior cells."""
+        if not self.free: return None
+        return self.to_pos(self.free[randrange(len(self.free))])
@@ -3,19 +3,17 @@ game.py
 
 Create a game instance which acts as a container for all the other elements (snake, apple).
 """
-from random import randrange
-
 import numpy as np
 
+from environment.observation import get_board_relative
 from environment.snake import Snake
-from utils.direction import DOWN, LEFT, RIGHT, turn_left, turn_right
+from utils.direction import DIR_INDEX, turn_left, turn_right
 from utils.exceptions import PositionException
-from utils.pos import Pos
 
 
 class Game:
     __slots__ = {
-        'width', 'height', 'dim', 'pixels', 'score', 'steps',
+        'width', 'height', 'dim', 'pixels', 'score', 'steps', 'won',
         'snake',
         'apple', 'apple_separate',
         'board'
@@ -41,6 +39,7 @@ class Game:
         self.pixels = pixels
         self.score = 0
         self.steps = 0
+        self.won: bool = False  # Indicates if the snake filled the complete board
         
         # Initialise the snake
         self.snake = Snake(game=self)
@@ -73,13 +72,16 @@ class Game:
         
         # Update snake position
         try:
+            tail, apple = self.snake.body[-1], self.apple
             if self.snake.step(apple=self.apple):
                 self.set_apple_pos()
                 self.score += .5  # Reward for eating apple
+                tail = None  # Snake has grown, tail remains
             
-            # Update the board
-            self.update_board()
-            return True
+            # Update the board, the game is finished (and won) once the snake fills the complete board
+            self.update_board(tail=tail, apple=apple)
+            self.won = self.apple is None
+            return not self.won
         except PositionException:
             self.score -= .2 if random_a else 1  # Punish for hitting into a wall, less punishment if random action
             return False
@@ -88,16 +90,17 @@ class Game:
         """Reset the game environment."""
         self.score = 0
         self.steps = 0
-        self.clear_board()
+        self.won = False
         self.snake = Snake(game=self)
         self.set_apple_pos()
+        self.draw_board()
     
     # ----------------------------------------------------> BOARD <--------------------------------------------------- #
     
     def create_board(self):
-        """Create the initial board, which consists out of two layers: (snake+wall) and apple."""
+        """Create the initial board, which consists out of two layers: (snake+wall) and apple, stored as int8."""
         layers = 2 if self.apple_separate else 1
-        board = np.zeros((self.width, self.height, layers))
+        board = np.zeros((self.width, self.height, layers), dtype=np.int8)
         
         # Add walls
         board[0, :, 0] = np.ones((self.width,)) * -1
@@ -114,12 +117,26 @@ class Game:
         """Clear the snake positions from the board."""
         self.board[1:-1, 1:-1, :] *= 0
     
-    def update_board(self):
-        """Update the position of the snake and apple."""
+    def draw_board(self):
+        """Redraw the complete position of the snake and apple."""
         self.clear_board()
         for p in self.snake.body: self.board[p.x, p.y, 0] = -1
         self.board[self.apple.x, self.apple.y, 1 if self.apple_separate else 0] = 1
     
+    def update_board(self, tail=None, apple=None):
+        """
+        Update only the cells changed by the last step: the new head, the freed tail, and a respawned apple.
+        
+        :param tail: Position of the tail freed by the last step, None if the snake has grown
+        :param apple: Position of the apple before the last step
+        """
+        if tail is not None: self.board[tail.x, tail.y, 0] = 0
+        head = self.snake.body[0]
+        self.board[head.x, head.y, 0] = -1
+        if apple is not None and apple != self.apple:
+            if self.apple_separate: self.board[apple.x, apple.y, 1] = 0  # Otherwise overwritten by the head
+            if self.apple is not None: self.board[self.apple.x, self.apple.y, 1 if self.apple_separate else 0] = 1
+    
     def show_board(self):
         """Print out the board."""
         for row in reversed(range(self.width)):
@@ -134,28 +151,11 @@ class Game:
         print("---" * self.width)
     
     def get_board_relative(self):
-        """Transform the board position to first person viewing."""
-        # Get board dimensions
-        width = len(self.board)
-        height = len(self.board[0])
-        
-        # Center board
-        delta_width = int(width / 2) - self.snake.body[0][0]
-        delta_height = int(height / 2) - self.snake.body[0][1]
-        board = np.roll(self.board, delta_width, axis=0)
-        board = np.roll(board, delta_height, axis=1)
-        
-        # Rotate board
-        if self.snake.direction == RIGHT: board = np.rot90(board, 1)
-        if self.snake.direction == DOWN: board = np.rot90(board, 2)
-        if self.snake.direction == LEFT: board = np.rot90(board, 3)
-        return board  # shape = (height, width, depth)
+        """Transform the board position to first person viewing, using the precomputed gather table."""
+        return get_board_relative(self.board, self.snake.body[0], DIR_INDEX[self.snake.direction])
     
     # ----------------------------------------------------> APPLE <--------------------------------------------------- #
     
     def set_apple_pos(self):
-        """Get random free location in the game."""
-        self.apple = None
-        while not self.apple or self.apple in self.snake.body:
-            self.apple = Pos(x=randrange(1, self.width - 1),
-                             y=randrange(1, self.height - 1))
+        """Get random free location in the game, drawn from the snake's index of free cells, None if it's full."""
+        self.apple = self.snake.body.random_free()
@@ -4,23 +4,30 @@ manager.py
 Manager to train and evaluate the Agents.
 """
 import json
+from concurrent.futures import ThreadPoolExecutor
 from time import time
 
+import numpy as np
 import tensorflow as tf
 from tqdm import tqdm
 
+from environment.actor_learner import ActorLearner
 from environment.game import Game
+from environment.subproc_vec_game import SubprocVecGame
 
 
 class Manager:
     __slots__ = {
-        'agent', 'n_envs', 'max_steps',
+        'agent', 'n_envs', 'max_steps', 'auto_reset', 'n_workers', 'envs', 'pipeline',
     }
     
     def __init__(self,
                  agent,
                  n_envs: int = 1024,
                  max_steps: int = 1000,
+                 auto_reset: bool = False,
+                 n_workers: int = 0,
+                 pipeline: int = 1,
                  ):
         """
         Initialise the manager, which manages training and evaluation of the agents.
@@ -28,47 +35,195 @@ class Manager:
         :param agent: Agent to train/evaluate
         :param n_envs: Number of environments on which the agent is trained in parallel
         :param max_steps: Maximum number of steps during each training/evaluation session
+        :param auto_reset: Restart finished games during training immediately as a new episode
+        :param n_workers: Number of worker processes stepping the games during training, 0 to step these in-process;
+                          the agent needs to support a VecGame
+        :param pipeline: Number of groups the environments are split in during training, while one group is queried
+                         the previous group is stepped on a separate thread
         """
         self.agent = agent
         self.n_envs = n_envs
         self.max_steps = max_steps
+        self.auto_reset = auto_reset
+        self.n_workers = n_workers
+        self.envs: SubprocVecGame = None  # Games stepped by the workers, kept over the training sessions
+        self.pipeline = pipeline
     
     def train(self):
         """
-        Play the game while recording actions and rewards, which are used afterwards to train the agent model on.
+        Play the game while recording actions and rewards, which are used afterwards to train the agent model on. Only
+        the games that are still running are queried and progressed. If auto_reset is set, finished games restart
+        immediately as a new episode such that every environment keeps playing until the maximum number of steps.
         
-        :return: Scores (per game), durations (pg), snake-length (pg), training loss
+        If pipeline is set, the environments are split in groups that are queried one after the other. Each group is
+        stepped on a separate thread while the next group is queried, hiding the stepping behind the inference.
+        
+        :return: Scores (per episode), durations (pe), snake-length (pe), training metrics
         """
+        if self.n_workers > 0: return self.train_parallel()
+        self.close()  # Workers of a previous parallel session aren't needed anymore
+        
         # Create all the games
         games = []
         for _ in range(self.n_envs): games.append(Game())
         
         # Reset the agent
         self.agent.training = True
-        self.agent.reset(n_envs=self.n_envs, sample_game=games[0])
+        self.agent.reset(n_envs=self.n_envs, sample_game=games[0], max_steps=self.max_steps)
         
-        # Evaluate the agent on the different games
-        duration = [0, ] * self.n_envs  # First iteration gets duration 0
-        finished = [False, ] * self.n_envs
-        while not all(finished) and max(duration) < self.max_steps:
-            # Get the actions for the current states
-            actions = self.agent(games)
+        # Keep track of the episodes, each environment starts with its own episode
+        episode = list(range(self.n_envs))  # Episode currently played by each of the environments
+        duration = [0, ] * self.n_envs  # Duration of each episode, first iteration gets duration 0
+        died = [False, ] * self.n_envs  # Indicates if the episode ended by dying
+        won = [False, ] * self.n_envs  # Indicates if the episode ended by filling the complete board
+        scores = [None, ] * self.n_envs  # Final score of each episode
+        length = [None, ] * self.n_envs  # Final snake-length of each episode
+        
+        def step(active, actions):
+            """Go over each running game of the group and progress by one."""
             uses_tuple = isinstance(actions[0], tuple)
-            
-            # Go over each game and progress by one
-            for i, (g, a, f) in enumerate(zip(games, actions, finished)):
-                if not f:
-                    # Progress the game with one step
-                    finished[i] = not g.step(a=a, uses_tuple=uses_tuple)
+            for i, a in zip(active, actions):
+                # Progress the game with one step
+                finished[i] = not games[i].step(a=a, uses_tuple=uses_tuple)
+                
+                # Progress duration of the episode, and record its results if it has ended
+                duration[episode[i]] += 1
+                if finished[i]:
+                    won[episode[i]] = games[i].won
+                    died[episode[i]] = not games[i].won
+                    scores[episode[i]] = games[i].score
+                    length[episode[i]] = len(games[i].snake.body)
+        
+        # Evaluate the agent on the different games, at most one group is stepped while the next one is queried
+        finished = [False, ] * self.n_envs
+        groups = [list(range(self.n_envs))[k::self.pipeline] for k in range(self.pipeline)]
+        executor = ThreadPoolExecutor(max_workers=1) if self.pipeline > 1 else None
+        pending, pending_group = None, None  # Step that is in progress, and the group it belongs to
+        try:
+            for _ in range(self.max_steps):
+                running = False
+                for k, group in enumerate(groups):
+                    # The group's previous step needs to be done before it's queried again
+                    if pending_group == k:
+                        pending.result()
+                        pending, pending_group = None, None
                     
-                    # Progress duration of game
-                    duration[i] += 1
+                    # Restart the finished games as new episodes
+                    if self.auto_reset:
+                        for i in [i for i in group if finished[i]]:
+                            games[i].reset()
+                            self.agent.reset_env(i)
+                            finished[i] = False
+                            episode[i] = len(duration)
+                            duration.append(0)
+                            died.append(False)
+                            won.append(False)
+                            scores.append(None)
+                            length.append(None)
+                    
+                    # Only query the games that are still running
+                    active = [i for i in group if not finished[i]]
+                    if not active: continue
+                    running = True
+                    
+                    # Get the actions for the current states, while the previous group is being stepped
+                    actions = self.agent([games[i] for i in active], envs=active)
+                    if pending is not None: pending.result()
+                    if executor is None:
+                        step(active, actions)
+                    else:
+                        pending, pending_group = executor.submit(step, active, actions), k
+                if not running: break
+                self.agent.end_step()
+            if pending is not None: pending.result()
+        finally:
+            if executor is not None: executor.shutdown()
+        
+        # Record the results of the episodes that are still running
+        for i, g in enumerate(games):
+            if not finished[i]:
+                scores[episode[i]] = g.score
+                length[episode[i]] = len(g.snake.body)
         
         # Train the model before returning the scores
-        loss = self.agent.train(duration=duration, max_duration=self.max_steps)
+        metrics = self.agent.train(duration=duration, max_duration=self.max_steps, died=died, won=won)
         
-        # Return the final scores of each game
-        return [g.score for g in games], duration, [len(g.snake.body) for g in games], loss
+        # Return the final scores of each episode
+        return scores, duration, length, metrics
+    
+    def train_parallel(self):
+        """
+        Same as train, but the games are stepped by the worker processes, which write the states straight into shared
+        memory. The running games are queried and progressed all at once.
+        
+        :return: Scores (per episode), durations (pe), snake-length (pe), training metrics
+        """
+        # Start the workers once, these are only restarted if the number of environments changes
+        if self.envs is None or len(self.envs) != self.n_envs or self.envs.n_workers != self.n_workers:
+            self.close()
+            self.envs = SubprocVecGame(n_envs=self.n_envs, n_workers=self.n_workers)
+        games = self.envs
+        games.reset()
+        
+        # Reset the agent
+        self.agent.training = True
+        self.agent.reset(n_envs=self.n_envs, sample_game=Game(), max_steps=self.max_steps)
+        
+        # Keep track of the episodes, each environment starts with its own episode
+        episode = np.arange(self.n_envs)  # Episode currently played by each of the environments
+        duration = [0, ] * self.n_envs  # Duration of each episode
+        died = [False, ] * self.n_envs  # Indicates if the episode ended by dying
+        won = [False, ] * self.n_envs  # Indicates if the episode ended by filling the complete board
+        scores = [None, ] * self.n_envs  # Final score of each episode
+        length = [None, ] * self.n_envs  # Final snake-length of each episode
+        
+        # Evaluate the agent on the different games
+        a = np.zeros((self.n_envs,), dtype=np.int64)
+        randomised = np.zeros((self.n_envs,), dtype=bool)
+        for _ in range(self.max_steps):
+            # Restart the finished games as new episodes
+            if self.auto_reset and not games.alive.all():
+                finished = np.flatnonzero(~games.alive)
+                games.reset(mask=~games.alive)
+                for i in finished:
+                    self.agent.reset_env(i)
+                    episode[i] = len(duration)
+                    duration.append(0)
+                    died.append(False)
+                    won.append(False)
+                    scores.append(None)
+                    length.append(None)
+            
+            # Only query the games that are still running
+            active = np.flatnonzero(games.alive)
+            if len(active) == 0: break
+            actions = self.agent(games if len(active) == self.n_envs else games.select(active), envs=active.tolist())
+            
+            # Progress all running games at once
+            if isinstance(actions[0], tuple):
+                a[active], randomised[active] = zip(*actions)
+            else:
+                a[active], randomised[active] = actions, False
+            alive, _, _ = games.step(a, randomised=randomised)
+            self.agent.end_step()
+            
+            # Record the results of the episodes that have ended
+            for i in active[~alive[active]]:
+                won[episode[i]] = bool(games.won[i])
+                died[episode[i]] = not games.won[i]
+                duration[episode[i]] = int(games.steps[i])
+                scores[episode[i]] = float(games.score[i])
+                length[episode[i]] = int(games.length[i])
+        
+        # Record the results of the episodes that are still running
+        for i in np.flatnonzero(games.alive):
+            duration[episode[i]] = int(games.steps[i])
+            scores[episode[i]] = float(games.score[i])
+            length[episode[i]] = int(games.length[i])
+        
+        # Train the model before returning the scores
+        metrics = self.agent.train(duration=duration, max_duration=self.max_steps, died=died, won=won)
+        return scores, duration, length, metrics
     
     def train_scheme(self, scheme_path):
         """Train the model under a certain training scheme, write statistics to TensorBoard each training session."""
@@ -80,36 +235,59 @@ class Manager:
         writer = tf.summary.create_file_writer(
                 f"./logs/{self.agent.tag}_{self.agent.model_t}_{self.agent.model_v}_{time()}")
         
-        # Iterate over all the schemes
+        # Iterate over all the schemes, the game workers are stopped once all of them are done
         epoch = 0
-        for scheme in schemes:
-            self.set_scheme(path=scheme_path, scheme=scheme)
-            self.print_configuration(iterations=scheme['iterations'])
-            
-            # Run
-            pbar = tqdm(range(scheme['iterations']), desc=f"avg_score={-1}, avg_duration={0}")
-            for _ in pbar:
-                scores, durations, snake_length, loss = self.train()
+        try:
+            for scheme in schemes:
+                self.set_scheme(path=scheme_path, scheme=scheme)
+                self.print_configuration(iterations=scheme['iterations'])
                 
-                # Write summary of session to TensorBoard
-                write_to_tensorboard(writer=writer,
-                                     iteration=epoch,
-                                     scores=scores,
-                                     durations=durations,
-                                     length=snake_length,
-                                     loss=loss)
-                pbar.set_description(f"avg score={round(sum(scores) / len(scores), 2)}, "
-                                     f"avg duration={round(sum(durations) / len(durations), 2)}")
-                epoch += 1
+                # Rollouts and training overlap if the scheme uses actor processes, each iteration then consumes as many
+                # transitions as a sequential training session would play
+                actor_learner = None
+                if scheme.get('actors', 0) > 0:
+                    actor_learner = ActorLearner(agent=self.agent, n_actors=scheme['actors'], n_envs=self.n_envs,
+                                                 max_steps=self.max_steps, chunk=scheme.get('chunk', 20),
+                                                 publish_rate=scheme.get('publish_rate', 10))
                 
-                # Save agent model every 5 epochs
-                if epoch % 5 == 0: self.agent.save_model(epoch=epoch)
+                # Run
+                pbar = tqdm(range(scheme['iterations']), desc=f"avg_score={-1}, avg_duration={0}")
+                for _ in pbar:
+                    if actor_learner is not None:
+                        scores, durations, snake_length, metrics = actor_learner(n_steps=self.n_envs * self.max_steps)
+                    else:
+                        scores, durations, snake_length, metrics = self.train()
+                    
+                    # Write summary of session to TensorBoard
+                    write_to_tensorboard(writer=writer,
+                                         iteration=epoch,
+                                         scores=scores,
+                                         durations=durations,
+                                         length=snake_length,
+                                         metrics=metrics)
+                    pbar.set_description(f"avg score={round(sum(scores) / len(scores), 2)}, "
+                                         f"avg duration={round(sum(durations) / len(durations), 2)}")
+                    epoch += 1
+                    
+                    # Checkpoint agent model every 5 epochs, written in the background
+                    if epoch % 5 == 0: self.agent.save_model(epoch=epoch)
+                if actor_learner is not None: actor_learner.close()
+        finally:
+            self.close()
+    
+    def close(self):
+        """Stop the game workers and release their shared memory, the next parallel training session restarts them."""
+        if self.envs is not None: self.envs.close()
+        self.envs = None
     
     def set_scheme(self, path, scheme):
         """Update the manager and agent's parameters to be conform with the scheme."""
         # Update game environment
         self.n_envs = scheme['n_env']
         self.max_steps = scheme['steps']
+        self.auto_reset = scheme.get('auto_reset', self.auto_reset)
+        self.n_workers = scheme.get('workers', self.n_workers)
+        self.pipeline = scheme.get('pipeline', self.pipeline)
         
         # Update the agent
         if 'dql' in path:
@@ -119,6 +297,11 @@ class Manager:
             self.agent.eps_max = scheme['eps_max']
             self.agent.eps_min = scheme['eps_min']
             self.agent.a_star_ratio = scheme['a_star_ratio']
+            self.agent.batch_size = scheme.get('batch_size', self.agent.batch_size)
+            self.agent.accumulate = scheme.get('accumulate', self.agent.accumulate)
+            self.agent.replay_size = scheme.get('replay_size', self.agent.replay_size)
+            self.agent.target_sync = scheme.get('target_sync', self.agent.target_sync)
+            self.agent.n_updates = scheme.get('n_updates', self.agent.n_updates)
         else:
             raise NotImplementedError
     
@@ -130,6 +313,9 @@ class Manager:
               f"\titerations={iterations}\n"
               f"\tnumber of environments={self.n_envs}\n"
               f"\tgame steps={self.max_steps}\n"
+              f"\tauto reset={self.auto_reset}\n"
+              f"\tworkers={self.n_workers}\n"
+              f"\tpipeline={self.pipeline}\n"
               f"\tagent={agent_str}\n")
     
     def evaluate(self):
@@ -141,7 +327,7 @@ class Manager:
         for _ in range(self.n_envs): games.append(Game())
         
         # Reset the agent
-        self.agent.reset(n_envs=self.n_envs, sample_game=games[0])
+        self.agent.reset(n_envs=self.n_envs, sample_game=games[0], max_steps=self.max_steps)
         
         # Evaluate the agent on the different games
         step = 0
@@ -151,21 +337,21 @@ class Manager:
             progress.update()
             step += 1
             
-            # Get the actions for the current states
-            actions = self.agent(games=games)
+            # Get the actions for the current states of the games that are still running
+            active = [i for i, f in enumerate(finished) if not f]
+            actions = self.agent(games=[games[i] for i in active], envs=active)
             
-            # Go over each game and progress by one
-            for i, (g, a, f) in enumerate(zip(games, actions, finished)):
-                if not f:
-                    # Progress the game with one step
-                    finished[i] = not g.step(a=a)
+            # Go over each running game and progress by one
+            for i, a in zip(active, actions):
+                # Progress the game with one step
+                finished[i] = not games[i].step(a=a)
         progress.close()
         
         # Return the final scores of each game
         return [g.score for g in games]
 
 
-def write_to_tensorboard(writer, iteration, scores, durations, length, loss):
+def write_to_tensorboard(writer, iteration, scores, durations, length, metrics):
     """Write the data of a single training session to TensorBoard."""
     # Sort each of the lists
     scores = sorted(scores)
@@ -188,4 +374,5 @@ def write_to_tensorboard(writer, iteration, scores, durations, length, loss):
         tf.summary.scalar(name='duration percentile/50th', data=durations[int(.5 * len(durations))], step=iteration)
         tf.summary.scalar(name='duration percentile/75th', data=durations[int(.75 * len(durations))], step=iteration)
         
-        tf.summary.scalar(name='training loss', data=loss, step=iteration)
+        for name, value in (metrics or {}).items():
+            tf.summary.scalar(name=f'training {name}', data=value, step=iteration)
@@ -0,0 +1,97 @@
+"""
+observation.py
+
+Precomputed gather tables to transform boards to first person viewing, for a single or many games at once.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from utils.direction import DIR, DIR_INDEX
+
+
+@lru_cache(maxsize=None)
+def get_gather_table(width, height):
+    """
+    Create the table mapping each (head position, direction) to the board cells seen in first person view. The view
+    centers the board around the head and rotates it such that the snake is always heading upwards.
+    
+    :param width: Width of the board
+    :param height: Height of the board
+    :return: Array of shape (width * height, len(DIR), width * height) containing flat board indices
+    """
+    cells = np.arange(width * height).reshape(width, height)
+    table = np.empty((width * height, len(DIR), width * height), dtype=np.int64)
+    for x in range(width):
+        for y in range(height):
+            # Center board
+            view = np.roll(cells, width // 2 - x, axis=0)
+            view = np.roll(view, height // 2 - y, axis=1)
+            
+            # Rotate board, DIR is sorted clockwise starting from UP
+            for d in range(len(DIR)):
+                table[x * height + y, d] = np.rot90(view, d).ravel()
+    table.setflags(write=False)
+    return table
+
+
+def get_board_relative(board, head, direction):
+    """
+    Transform a single board to first person viewing.
+    
+    :param board: Board of shape (width, height, depth)
+    :param head: Position of the snake's head
+    :param direction: Index in DIR of the snake's heading
+    :return: Board of shape (height, width, depth)
+    """
+    width, height, layers = board.shape
+    view = board.reshape(-1, layers)[get_gather_table(width, height)[head[0] * height + head[1], direction]]
+    return view.reshape((width, height, layers) if direction % 2 == 0 else (height, width, layers))
+
+
+def get_boards_relative(boards, heads, directions, out=None):
+    """
+    Transform a batch of square boards to first person viewing via a single gather.
+    
+    :param boards: Boards of shape (N, width, height, depth)
+    :param heads: Array of shape (N, 2) with the position of each snake's head
+    :param directions: Array of shape (N,) with the index in DIR of each snake's heading
+    :param out: Optional preallocated (contiguous) output array with the same shape as boards
+    :return: Boards of shape (N, height, width, depth)
+    """
+    n, width, height, layers = boards.shape
+    assert width == height  # Rotated views of non-square boards don't share a shape
+    heads = np.asarray(heads)
+    idx = get_gather_table(width, height)[heads[:, 0] * height + heads[:, 1], directions]
+    idx += (np.arange(n) * (width * height))[:, None]
+    if out is None: out = np.empty(boards.shape, dtype=boards.dtype)
+    np.take(boards.reshape(-1, layers), idx, axis=0, out=out.reshape(n, width * height, layers))
+    return out
+
+
+def get_games_relative(games, out=None):
+    """
+    Get the first person view of each of the given games.
+    
+    :param games: List of Game objects, or a VecGame
+    :param out: Optional preallocated output array
+    :return: Boards of shape (N, height, width, depth)
+    """
+    if not isinstance(games, list): return games.get_board_relative(out=out)  # VecGame
+    boards, heads, directions, _ = get_games_state(games)
+    return get_boards_relative(boards, heads, directions, out=out)
+
+
+def get_games_state(games):
+    """
+    Get the state of the given games as arrays, shared with the VecGame layout.
+    
+    :param games: List of Game objects, or a VecGame
+    :return: Tuple of arrays: boards (N, width, height, depth), heads (N, 2), directions (N,), apples (N, 2)
+    """
+    if not isinstance(games, list): return games.board, games.head, games.direction, games.apple  # VecGame
+    boards = np.stack([g.board for g in games])
+    heads = np.asarray([(g.snake.body[0].x, g.snake.body[0].y) for g in games])
+    directions = np.asarray([DIR_INDEX[g.snake.direction] for g in games])
+    apples = np.asarray([(g.apple.x, g.apple.y) for g in games])
+    return boards, heads, directions, apples
@@ -5,6 +5,7 @@ Entity representing the snake object within the game.
 """
 from random import choice, randrange
 
+from environment.body import Body
 from utils.direction import DIR
 from utils.exceptions import PositionException
 from utils.pos import Pos
@@ -25,7 +26,7 @@ class Snake:
         :param game: Game object in which the snake operates
         :param length_init: Initial length of the snake
         """
-        self.body: list = []  # List of sorted positions to represent the snake (head to tail)
+        self.body: Body = Body(width=game.width, height=game.height)  # Sorted positions (head to tail)
         self.direction: tuple = None  # Direction to which the snake is heading
         self.game = game  # Game object
         self.length: int = 0
@@ -39,11 +40,12 @@ class Snake:
         self.direction = choice(DIR)  # Random initial direction
         pos = Pos(x=randrange(self.length_init + 1, self.game.width - (self.length_init + 1)),
                   y=randrange(self.length_init + 1, self.game.height - (self.length_init + 1)))
-        self.body = [pos]
+        self.body.clear()
+        self.body.add_head(pos)
         self.length = 1
         
         # Initial snake has length of 3
-        for _ in range(self.length_init - 1): self.step(apple=Pos(t=self.direction) + self.body[0])
+        for _ in range(self.length_init - 1): self.step(apple=self.body[0] + self.direction)
     
     def step(self, apple=None):
         """
@@ -51,20 +53,20 @@ class Snake:
         
         :param apple: Position of the apple
         """
-        # Add new position for the head
-        self.body.insert(0, Pos(t=self.direction) + self.body[0])
-        
-        # Check if valid new position
-        if self.body[0] in self.body[1:] or \
-                self.body[0].x in [0, self.game.width - 1] or \
-                self.body[0].y in [0, self.game.height - 1]:
-            self.body = self.body[:-1]
+        # Check if valid new position for the head, the tail hasn't moved yet
+        head = self.body[0] + self.direction
+        if head in self.body or \
+                head.x in [0, self.game.width - 1] or \
+                head.y in [0, self.game.height - 1]:
             raise PositionException("Invalid snake position")
         
+        # Add new position for the head
+        self.body.add_head(head)
+        
         # Enlarge snake if apple is eaten
-        if apple and self.body[0] == apple:
+        if apple and head == apple:
             self.length += 1
             return True
         else:
-            self.body = self.body[:-1]
+            self.body.remove_tail()
             return False
@@ -0,0 +1,270 @@
+"""
+subproc_vec_game.py
+
+Vectorised game engine of which the games are split over worker processes. The state of all games lives in shared
+memory, each worker steps its own shard of the games and writes the first person views straight next to it.
+"""
+import weakref
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from environment.vec_game import VecGame, get_state_layout
+from utils.shared import attach, get_context, get_layout
+
+
+class SubprocVecGame(VecGame):
+    __slots__ = {
+        'n_workers', 'bounds', 'shm', 'shared', 'obs', 'actions', 'randomised', 'mask', 'eaten', 'pipes',
+        'processes', '_finalizer', '__weakref__',
+    }
+    
+    def __init__(self,
+                 n_envs,
+                 n_workers,
+                 width=11,
+                 height=11,
+                 apple_separate=True,
+                 length_init=3,
+                 ):
+        """
+        Container of n_envs games that are all progressed by a single step-call, sharded over the worker processes.
+        The state arrays are views on the shared memory, hence these can be read like those of a VecGame.
+        
+        :param n_envs: Number of games played in parallel
+        :param n_workers: Number of worker processes
+        :param width: Width of the playing field
+        :param height: Height of the playing field
+        :param apple_separate: Give the apple its own board
+        :param length_init: Initial length of the snake
+        """
+        self.n_workers: int = max(min(n_workers, n_envs), 1)
+        self.bounds = np.linspace(0, n_envs, self.n_workers + 1).astype(int)  # Games [lo, hi) of each worker
+        self.shm = None  # Shared memory holding the state arrays, allocated once the board shape is known
+        self.pipes = None  # Connection to each of the workers, the workers reset their games themselves on start
+        super().__init__(n_envs=n_envs, width=width, height=height, apple_separate=apple_separate,
+                         length_init=length_init)
+        
+        # Start the workers, each stepping its own shard of the games
+        ctx = get_context()
+        self.pipes, self.processes = [], []
+        for lo, hi in zip(self.bounds[:-1].tolist(), self.bounds[1:].tolist()):
+            parent, child = ctx.Pipe()
+            process = ctx.Process(target=run_worker, daemon=True, args=(
+                child, self.shm.name, n_envs, lo, hi, self.width, self.height, apple_separate, length_init))
+            process.start()
+            self.pipes.append(parent)
+            self.processes.append(process)
+        self._finalizer = weakref.finalize(self, release, self.pipes, self.processes, self.shm)
+        self.wait()
+    
+    def __str__(self):
+        return f"SubprocVecGame(n_envs={self.n_envs}, n_workers={self.n_workers})"
+    
+    # ----------------------------------------------------> MAIN <---------------------------------------------------- #
+    
+    def step(self, a, randomised=None):
+        """
+        Update all the running games with their corresponding action, finished games are left untouched.
+        
+        :param a: Array of N actions, each either 0 (straight), 1 (left), or 2 (right)
+        :param randomised: Optional boolean array indicating which actions were randomised
+        :return: Tuple of arrays: alive (bool), eaten (bool), score (float)
+        """
+        self.actions[:] = a
+        self.randomised[:] = False if randomised is None else randomised
+        self.send('step')
+        return self.alive.copy(), self.eaten.copy(), self.score.copy()
+    
+    def reset(self, mask=None):
+        """
+        Reset the requested game environments.
+        
+        :param mask: Optional boolean array of length N indicating which games to reset, all games if None
+        """
+        if self.board is None: self.create_state()
+        if self.pipes is None: return  # Workers reset their games on start
+        self.mask[:] = True if mask is None else mask
+        self.send('reset', shards=[self.mask[lo:hi].any() for lo, hi in zip(self.bounds[:-1], self.bounds[1:])])
+    
+    def send(self, command, shards=None):
+        """Send the command to the workers (of the selected shards), and wait until all of them are done."""
+        if shards is None: shards = [True] * self.n_workers
+        for pipe, s in zip(self.pipes, shards):
+            if s: pipe.send(command)
+        self.wait(shards=shards)
+    
+    def wait(self, shards=None):
+        """Wait until the workers (of the selected shards) are done."""
+        if shards is None: shards = [True] * self.n_workers
+        for pipe, s in zip(self.pipes, shards):
+            if s and not pipe.recv(): raise Exception("Game worker failed")
+    
+    def close(self):
+        """Stop the workers and release the shared memory."""
+        self._finalizer()
+    
+    # ----------------------------------------------------> BOARD <--------------------------------------------------- #
+    
+    def create_state(self):
+        """Allocate the shared memory, the state arrays and the worker I/O are views on it."""
+        arrays = get_arrays(self.n_envs, self.width, self.height, self.apple_separate)
+        self.shm = SharedMemory(create=True, size=get_layout(arrays.values())[1])
+        self.shared = dict(zip(arrays, attach(self.shm.buf, arrays.values())))
+        self.obs, self.actions, self.randomised, self.mask, self.eaten = (
+            self.shared[name] for name in ('obs', 'actions', 'randomised', 'mask', 'eaten'))
+        super().create_state()
+    
+    def allocate(self, name, shape, dtype):
+        """Get the shared state array with the given name."""
+        view = self.shared[name]
+        view[:] = 0
+        return view
+    
+    def get_board_relative(self, out=None):
+        """
+        Get the first person views, which the workers write after each step.
+        
+        :param out: Optional preallocated output array of shape (N, height, width, depth)
+        :return: Boards of shape (N, height, width, depth), a view on the shared memory if out is None
+        """
+        if out is None: return self.obs
+        np.copyto(out, self.obs)
+        return out
+    
+    def select(self, idx):
+        """
+        Select the requested games without copying their state, for example to only query an agent on the games that
+        are still running.
+        
+        :param idx: Indices of the selected games
+        :return: Selection that's read like a VecGame, holding the first person views written by the workers
+        """
+        return SubprocSelection(games=self, idx=idx)
+
+
+class SubprocSelection:
+    __slots__ = {
+        'games', 'idx', 'n_envs',
+    }
+    
+    def __init__(self, games, idx):
+        """
+        Selection of the games of a SubprocVecGame. The rows of a state array are only gathered once the array is read,
+        the first person views are taken from those the workers wrote after the last step.
+        
+        :param games: SubprocVecGame from which the games are selected
+        :param idx: Indices of the selected games
+        """
+        self.games: SubprocVecGame = games
+        self.idx = np.asarray(idx)
+        self.n_envs: int = len(self.idx)
+    
+    def __str__(self):
+        return f"SubprocSelection(n_envs={self.n_envs})"
+    
+    def __len__(self):
+        return self.n_envs
+    
+    def __getattr__(self, name):
+        """Get the selected rows of the shared array with the given name, other attributes are those of the games."""
+        if name in self.games.shared: return self.games.shared[name][self.idx]
+        return getattr(self.games, name)
+    
+    def get_tail(self):
+        """Get the flat index (x * height + y) of each selected snake's tail."""
+        games, idx = self.games, self.idx
+        return games.body[idx, (games.body_head[idx] - games.length[idx] + 1) % games.capacity]
+    
+    def get_board_relative(self, out=None):
+        """
+        Get the first person views of the selected games.
+        
+        :param out: Optional preallocated output array of shape (N, height, width, depth)
+        :return: Boards of shape (N, height, width, depth)
+        """
+        return np.take(self.games.obs, self.idx, axis=0, out=out)
+
+
+class ShardVecGame(VecGame):
+    __slots__ = {
+        'shared',
+    }
+    
+    def __init__(self, shared, n_envs, width, height, apple_separate, length_init):
+        """
+        VecGame of which the state arrays are the worker's shard of the shared arrays.
+        
+        :param shared: Dictionary of the shard's views on each of the shared arrays
+        """
+        self.shared = shared
+        super().__init__(n_envs=n_envs, width=width, height=height, apple_separate=apple_separate,
+                         length_init=length_init)
+    
+    def allocate(self, name, shape, dtype):
+        """Get the shard of the shared state array with the given name."""
+        view = self.shared[name]
+        view[:] = 0
+        return view
+
+
+def get_arrays(n_envs, width, height, apple_separate=True):
+    """Get the (dtype, shape) of each shared array by name, the game state followed by the worker I/O."""
+    layers = 2 if apple_separate else 1
+    arrays = {name: (dtype, shape) for name, dtype, shape in get_state_layout(n_envs, width, height, apple_separate)}
+    arrays.update({
+        'obs': (np.int8, (n_envs, height, width, layers)),  # First person view of each game
+        'actions': (np.int64, (n_envs,)),  # Action of each game for the next step
+        'randomised': (bool, (n_envs,)),  # Indicates if the action was randomised
+        'mask': (bool, (n_envs,)),  # Games that are reset
+        'eaten': (bool, (n_envs,)),  # Indicates if the apple was eaten during the last step
+    })
+    return arrays
+
+
+def run_worker(pipe, name, n_envs, lo, hi, width, height, apple_separate, length_init):
+    """Step and reset the games lo up to hi on command, their views are written after each command."""
+    shm = SharedMemory(name=name)
+    arrays = get_arrays(n_envs, width, height, apple_separate)
+    shared = {k: v[lo:hi] for k, v in zip(arrays, attach(shm.buf, arrays.values()))}
+    try:
+        games = ShardVecGame(shared=shared, n_envs=hi - lo, width=width, height=height, apple_separate=apple_separate,
+                             length_init=length_init)
+        games.get_board_relative(out=shared['obs'])
+        pipe.send(True)
+        while True:
+            command = pipe.recv()
+            if command == 'step':
+                _, eaten, _ = games.step(shared['actions'], randomised=shared['randomised'])
+                shared['eaten'][:] = eaten
+            elif command == 'reset':
+                games.reset(mask=shared['mask'])
+            else:  # Close
+                break
+            games.get_board_relative(out=shared['obs'])
+            pipe.send(True)
+    except (EOFError, KeyboardInterrupt):
+        pass
+    except Exception:
+        pipe.send(False)
+        raise
+    finally:
+        games = shared = None  # Release the views on the shared memory
+        shm.close()
+
+
+def release(pipes, processes, shm):
+    """Stop the workers and unlink the shared memory."""
+    for pipe in pipes:
+        try:
+            pipe.send('close')
+        except (BrokenPipeError, OSError):
+            pass
+    for p in processes:
+        p.join(timeout=5)
+        if p.exitcode is None: p.terminate()
+    try:
+        shm.close()
+    except BufferError:  # The state arrays are still in use, the mapping is released together with them
+        pass
+    shm.unlink()
@@ -0,0 +1,254 @@
+"""
+vec_game.py
+
+Vectorised game engine which keeps the state of many games in shared arrays and progresses all of them at once.
+"""
+import numpy as np
+
+from environment.observation import get_boards_relative
+from utils.direction import DIR
+
+# Direction offsets, indexed in the same (clockwise) order as DIR
+DIR_OFFSET = np.asarray(DIR, dtype=np.int64)
+
+# Change in direction index for each of the actions: straight, left, right
+ACTION_TURN = np.asarray([0, len(DIR) - 1, 1], dtype=np.int64)
+
+
+class VecGame:
+    __slots__ = {
+        'n_envs', 'width', 'height', 'dim', 'apple_separate', 'length_init', 'capacity',
+        'board', 'head', 'direction', 'body', 'body_head', 'length', 'apple',
+        'score', 'steps', 'alive', 'won',
+    }
+    
+    def __init__(self,
+                 n_envs,
+                 width=11,
+                 height=11,
+                 apple_separate=True,
+                 length_init=3,
+                 ):
+        """
+        Container of n_envs games that are all progressed by a single step-call.
+        
+        :param n_envs: Number of games played in parallel
+        :param width: Width of the playing field
+        :param height: Height of the playing field
+        :param apple_separate: Give the apple its own board
+        :param length_init: Initial length of the snake
+        """
+        self.n_envs = n_envs
+        self.width = width if width % 2 == 1 else width + 1  # Always odd
+        self.height = height if height % 2 == 1 else height + 1  # Always odd
+        self.dim = (self.width, self.height)
+        self.apple_separate: bool = apple_separate
+        self.length_init = length_init
+        self.capacity = (self.width - 2) * (self.height - 2)  # Maximum length of a snake
+        
+        # Shared state of all the games
+        self.board = None  # (N, W, H, C) boards, same layout as Game.board
+        self.head = None  # (N, 2) position of the snake's head
+        self.direction = None  # (N,) index in DIR of the snake's heading
+        self.body = None  # (N, capacity) ring buffer of flat cell indices (x * height + y)
+        self.body_head = None  # (N,) index in the ring buffer of the head
+        self.length = None  # (N,) length of each snake
+        self.apple = None  # (N, 2) position of the apple
+        self.score = None  # (N,) score of each game
+        self.steps = None  # (N,) number of steps performed by each game
+        self.alive = None  # (N,) boolean indicating if the game is still running
+        self.won = None  # (N,) boolean indicating if the snake filled the complete board
+        
+        # Initialise all the games
+        self.reset()
+    
+    def __len__(self):
+        return self.n_envs
+    
+    # ----------------------------------------------------> MAIN <---------------------------------------------------- #
+    
+    def step(self, a, randomised=None):
+        """
+        Update all the running games with their corresponding action, finished games are left untouched.
+        
+        :param a: Array of N actions, each either 0 (straight), 1 (left), or 2 (right)
+        :param randomised: Optional boolean array indicating which actions were randomised
+        :return: Tuple of arrays: alive (bool), eaten (bool), score (float)
+        """
+        a = np.asarray(a, dtype=np.int64)
+        assert a.shape == (self.n_envs,)
+        eaten = np.zeros((self.n_envs,), dtype=bool)
+        idx = np.flatnonzero(self.alive)
+        if len(idx) == 0: return self.alive.copy(), eaten, self.score.copy()
+        
+        # Turn and move the heads
+        self.direction[idx] = (self.direction[idx] + ACTION_TURN[a[idx]]) % len(DIR)
+        new_head = self.head[idx] + DIR_OFFSET[self.direction[idx]]
+        x, y = new_head[:, 0], new_head[:, 1]
+        self.steps[idx] += 1
+        
+        # Walls and (not yet moved) body segments are both -1 on the first layer
+        dead = self.board[idx, x, y, 0] == -1
+        if dead.any():
+            d_idx = idx[dead]
+            punish = np.ones((len(d_idx),))
+            if randomised is not None: punish[np.asarray(randomised, dtype=bool)[d_idx]] = .2
+            self.score[d_idx] -= punish  # Punish for hitting into a wall, less punishment if random action
+            self.alive[d_idx] = False
+            idx, x, y = idx[~dead], x[~dead], y[~dead]
+        if len(idx) == 0: return self.alive.copy(), eaten, self.score.copy()
+        
+        # Remove the tail of the snakes that didn't eat
+        ate = (x == self.apple[idx, 0]) & (y == self.apple[idx, 1])
+        moved = idx[~ate]
+        tail = self.body[moved, (self.body_head[moved] - self.length[moved] + 1) % self.capacity]
+        self.board[moved, tail // self.height, tail % self.height, 0] = 0
+        
+        # Add the new heads
+        self.head[idx, 0], self.head[idx, 1] = x, y
+        self.body_head[idx] = (self.body_head[idx] + 1) % self.capacity
+        self.body[idx, self.body_head[idx]] = x * self.height + y
+        self.board[idx, x, y, 0] = -1
+        
+        # Enlarge the snakes that ate and place a new apple
+        eaten[idx[ate]] = True
+        if ate.any():
+            e_idx = idx[ate]
+            self.length[e_idx] += 1
+            self.score[e_idx] += .5  # Reward for eating apple
+            self.set_apple_pos(e_idx)
+        return self.alive.copy(), eaten, self.score.copy()
+    
+    def reset(self, mask=None):
+        """
+        Reset the requested game environments.
+        
+        :param mask: Optional boolean array of length N indicating which games to reset, all games if None
+        """
+        if self.board is None: self.create_state()
+        idx = np.arange(self.n_envs) if mask is None else np.flatnonzero(mask)
+        if len(idx) == 0: return
+        self.score[idx] = 0
+        self.steps[idx] = 0
+        self.alive[idx] = True
+        self.won[idx] = False
+        self.length[idx] = self.length_init
+        self.body_head[idx] = self.length_init - 1
+        
+        # Clear the boards
+        self.board[idx, 1:-1, 1:-1, :] = 0
+        
+        # Random initial direction and position of the tail, the snake is stretched out towards its direction
+        self.direction[idx] = np.random.randint(len(DIR), size=len(idx))
+        tail = np.stack([
+            np.random.randint(self.length_init + 1, self.width - (self.length_init + 1), size=len(idx)),
+            np.random.randint(self.length_init + 1, self.height - (self.length_init + 1), size=len(idx)),
+        ], axis=1)
+        offset = DIR_OFFSET[self.direction[idx]]
+        for i in range(self.length_init):
+            p = tail + i * offset
+            self.body[idx, i] = p[:, 0] * self.height + p[:, 1]
+            self.board[idx, p[:, 0], p[:, 1], 0] = -1
+        self.head[idx] = tail + (self.length_init - 1) * offset
+        
+        # Initialise the apple
+        self.set_apple_pos(idx)
+    
+    # ----------------------------------------------------> BOARD <--------------------------------------------------- #
+    
+    def create_state(self):
+        """Allocate the shared state arrays and draw the walls on the boards."""
+        for name, dtype, shape in get_state_layout(self.n_envs, self.width, self.height, self.apple_separate):
+            setattr(self, name, self.allocate(name=name, shape=shape, dtype=dtype))
+        self.board[:, 0, :, 0] = -1
+        self.board[:, -1, :, 0] = -1
+        self.board[:, :, 0, 0] = -1
+        self.board[:, :, -1, 0] = -1
+    
+    def allocate(self, name, shape, dtype):
+        """Allocate the (zeroed) state array with the given name."""
+        return np.zeros(shape, dtype=dtype)
+    
+    def select(self, idx):
+        """
+        Get a copy of the requested games, for example to only query an agent on the games that are still running.
+        
+        :param idx: Indices of the selected games
+        :return: VecGame holding a copy of the selected games' state
+        """
+        games = object.__new__(VecGame)
+        for name in ('width', 'height', 'dim', 'apple_separate', 'length_init', 'capacity'):
+            setattr(games, name, getattr(self, name))
+        games.n_envs = len(idx)
+        for name, _, _ in get_state_layout(0, self.width, self.height, self.apple_separate):
+            setattr(games, name, getattr(self, name)[idx])
+        return games
+    
+    def get_body(self, i):
+        """Get the body of the i'th snake as a list of (x, y) tuples, sorted from head to tail."""
+        ring = (self.body_head[i] - np.arange(self.length[i])) % self.capacity
+        return [(int(c // self.height), int(c % self.height)) for c in self.body[i, ring]]
+    
+    def get_tail(self):
+        """Get the flat index (x * height + y) of each snake's tail."""
+        return self.body[np.arange(self.n_envs), (self.body_head - self.length + 1) % self.capacity]
+    
+    def get_board_relative(self, out=None):
+        """
+        Transform the boards to first person viewing via a single gather.
+        
+        :param out: Optional preallocated output array of shape (N, height, width, depth)
+        :return: Boards of shape (N, height, width, depth)
+        """
+        return get_boards_relative(self.board, self.head, self.direction, out=out)
+    
+    # ----------------------------------------------------> APPLE <--------------------------------------------------- #
+    
+    def set_apple_pos(self, idx):
+        """
+        Place a new apple on a random free location for each of the requested games. Games without a free location
+        left (the snake fills the complete board) are finished, and won.
+        
+        :param idx: Indices of the games that need a new apple
+        """
+        layer = 1 if self.apple_separate else 0
+        if self.apple_separate: self.board[idx, self.apple[idx, 0], self.apple[idx, 1], layer] = 0
+        
+        # Draw a random key for each free interior cell, the highest key is the new apple's position
+        free = self.board[idx, 1:-1, 1:-1, 0].reshape(len(idx), -1) == 0
+        keys = np.where(free, np.random.random(free.shape), -1)
+        cell = keys.argmax(axis=1)
+        full = ~free[np.arange(len(idx)), cell]
+        self.alive[idx[full]] = False
+        self.won[idx[full]] = True
+        idx, cell = idx[~full], cell[~full]
+        self.apple[idx, 0] = cell // (self.height - 2) + 1
+        self.apple[idx, 1] = cell % (self.height - 2) + 1
+        self.board[idx, self.apple[idx, 0], self.apple[idx, 1], layer] = 1
+
+
+def get_state_layout(n_envs, width, height, apple_separate=True):
+    """
+    Get the layout of the state arrays of a VecGame.
+    
+    :param n_envs: Number of games
+    :param width: Width of the playing field
+    :param height: Height of the playing field
+    :param apple_separate: Give the apple its own board
+    :return: List of (name, dtype, shape) tuples, one for each of the state arrays
+    """
+    layers = 2 if apple_separate else 1
+    capacity = (width - 2) * (height - 2)
+    return [
+        ('board', np.int8, (n_envs, width, height, layers)),  # Boards, same layout as Game.board
+        ('head', np.int64, (n_envs, 2)),  # Position of the snake's head
+        ('direction', np.int64, (n_envs,)),  # Index in DIR of the snake's heading
+        ('body', np.int64, (n_envs, capacity)),  # Ring buffer of flat cell indices (x * height + y)
+        ('body_head', np.int64, (n_envs,)),  # Index in the ring buffer of the head
+        ('length', np.int64, (n_envs,)),  # Length of each snake
+        ('apple', np.int64, (n_envs, 2)),  # Position of the apple
+        ('score', np.float64, (n_envs,)),  # Score of each game
+        ('steps', np.int64, (n_envs,)),  # Number of steps performed by each game
+        ('alive', bool, (n_envs,)),  # Indicates if the game is still running
+        ('won', bool, (n_envs,)),  # Indicates if the snake filled the complete board
+    ]
@@ -6,8 +6,10 @@ Run the main functionality.
 import argparse
 
 from agents.a_star import AStar
+from agents.bfs import BFS
 from agents.dql_agent import DeepQLearning
 from agents.empty import Empty
+from agents.hamiltonian import Hamiltonian
 from environment.manager import Manager
 from models.handler import CNN, MLP
 from visualising.visualiser import live_visualisation
@@ -27,6 +29,10 @@ if __name__ == '__main__':
     # Go over all the options
     if args.agent_type == 'a_star':
         agent = AStar()
+    elif args.agent_type == 'bfs':
+        agent = BFS()
+    elif args.agent_type == 'hamiltonian':
+        agent = Hamiltonian()
     elif args.agent_type == 'manual':
         agent = Empty()
     elif args.agent_type == 'dql':
@@ -35,7 +41,7 @@ if __name__ == '__main__':
                               model_v=args.model_version)
     else:
         raise Exception(f"Agent of type '{args.agent_type} not supported', "
-                        f"choose from: 'a_star', 'manual', or 'dql'.")
+                        f"choose from: 'a_star', 'bfs', 'hamiltonian', 'manual', or 'dql'.")
     
     # Create manager instance
     manager = Manager(agent=agent)
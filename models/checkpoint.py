@@ -0,0 +1,97 @@
+"""
+checkpoint.py
+
+Background writer of weights-only checkpoints. The weights are snapshot on the calling thread, and written atomically
+on a separate thread such that checkpointing doesn't stall training.
+"""
+import os
+import queue
+import threading
+import weakref
+from collections import deque
+
+import numpy as np
+
+
+class CheckpointWriter:
+    __slots__ = {
+        'keep', 'queue', 'thread', 'history', '_finalizer', '__weakref__',
+    }
+    
+    def __init__(self, keep: int = 5):
+        """
+        Start the writer thread.
+        
+        :param keep: Number of rotated checkpoints that are kept, older ones are removed once a new one is written
+        """
+        self.keep: int = keep
+        self.queue = queue.Queue()  # Pending checkpoints, None stops the writer
+        self.history = deque()  # Rotated checkpoints written by this writer, oldest first
+        self.thread = threading.Thread(target=run_writer, args=(self.queue, self.history, keep), daemon=True)
+        self.thread.start()
+        self._finalizer = weakref.finalize(self, stop, self.queue, self.thread)
+    
+    def __str__(self):
+        return f"CheckpointWriter(keep={self.keep}, pending={self.queue.unfinished_tasks})"
+    
+    def save(self, model, path, rotate: bool = False):
+        """
+        Snapshot the model's weights, these are written in the background.
+        
+        :param model: Keras model of which the weights are saved
+        :param path: Path of the checkpoint file (.npz)
+        :param rotate: Count the checkpoint among the rotated checkpoints, of which only the last ones are kept
+        """
+        self.queue.put((path, model.get_weights(), rotate))  # get_weights returns copies
+    
+    def flush(self):
+        """Wait until all the pending checkpoints are written."""
+        self.queue.join()
+    
+    def close(self):
+        """Write the pending checkpoints and stop the writer."""
+        self._finalizer()
+
+
+def run_writer(jobs, history, keep):
+    """Write the checkpoints in the order in which they were saved, until None is received."""
+    while True:
+        job = jobs.get()
+        try:
+            if job is None: return
+            path, weights, rotate = job
+            write_weights(path, weights)
+            if rotate:
+                if path in history: history.remove(path)
+                history.append(path)
+                while len(history) > keep:
+                    old = history.popleft()
+                    if os.path.exists(old): os.remove(old)
+        except OSError as e:
+            print(f"==> Checkpoint not written: {e}")
+        finally:
+            jobs.task_done()
+
+
+def write_weights(path, weights):
+    """Write the weights to a temporary file first, which replaces the checkpoint once completely written."""
+    directory = os.path.dirname(path)
+    if directory: os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        np.savez(f, *weights)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_weights(path):
+    """Load the weights of a checkpoint, in the order of the model's get_weights."""
+    with np.load(path) as f:
+        return [f[f'arr_{i}'] for i in range(len(f.files))]
+
+
+def stop(jobs, thread):
+    """Stop the writer thread once the pending checkpoints are written."""
+    jobs.put(None)
+    thread.join()
@@ -16,6 +16,21 @@ def create_model(model_tag, input_dim):
     raise Exception(f"Model type '{model_tag}' not defined")
 
 
+def get_inference(model):
+    """
+    Create the compiled inference call of the model. The batch dimension is left open in the input signature, hence
+    the call is only traced once. The states are passed as int8, and only cast to float32 inside the compiled call.
+    
+    :param model: Keras model mapping states to the Q-value of each action
+    :return: Function mapping a batch of int8 states to the most likely action (int32) of each state
+    """
+    @tf.function(input_signature=[tf.TensorSpec(shape=(None,) + tuple(model.input_shape[1:]), dtype=tf.int8)])
+    def infer(states):
+        return tf.argmax(model(tf.cast(states, tf.float32), training=False), axis=1, output_type=tf.int32)
+    
+    return infer
+
+
 def get_mlp(input_dim):
     """
     Create a Multi-Layer Perceptron model.
@@ -0,0 +1,110 @@
+"""
+trainer.py
+
+Compiled training step of the models, fitting the minibatches streamed from the experience memory.
+"""
+import numpy as np
+import tensorflow as tf
+
+
+class Trainer:
+    __slots__ = {
+        'model', 'gradients', 'state_spec', 'steps', 'apply_step', 'updates',
+    }
+    
+    def __init__(self, model):
+        """
+        Trainer that fits the model on (state, target) pairs via a mean squared error, using the model's optimizer.
+        
+        :param model: Compiled Keras model
+        """
+        self.model = model
+        self.updates: int = 0  # Number of updates applied to the model
+        
+        # Gradients accumulated over the minibatches of a single update
+        self.gradients = [tf.Variable(tf.zeros_like(v), trainable=False) for v in model.trainable_variables]
+        
+        # Compiled steps, only the batch dimension is left open hence each of them is traced once
+        self.state_spec = tf.TensorSpec(shape=(None,) + tuple(model.input_shape[1:]), dtype=tf.int8)
+        self.steps = {}  # Compiled accumulation step for each of the target functions
+        self.apply_step = tf.function(self._apply_step, input_signature=[tf.TensorSpec(shape=(), dtype=tf.float32)])
+    
+    def __call__(self, batches, accumulate: int = 1, targets=None, params=(), priorities=None, on_update=None):
+        """
+        Train for a single pass over the minibatches.
+        
+        :param batches: Iterable (e.g. a tf.data pipeline) of minibatches (states, targets), the states being int8. If
+                        targets is given, the minibatches are (states, *columns) instead. If priorities is given, the
+                        minibatches are replayed samples, ending with the columns (weights, rows)
+        :param accumulate: Number of minibatches of which the gradients are accumulated before these are applied
+        :param targets: Function building the targets from the model's predictions and the columns of a minibatch, it's
+                        part of the compiled step hence the targets are built from the weights that are being trained.
+                        It returns the targets together with a mask of the entries of which the errors are reported
+        :param params: Scalar hyperparameters (e.g. the learning rate) passed to the target function after the columns,
+                       these are fed as tensors hence changing them in between the calls doesn't require a new trace
+        :param priorities: Callback receiving the rows and errors of each replayed minibatch, to update its priorities
+        :param on_update: Callback receiving the total number of applied updates, called after each update
+        :return: Dictionary of metrics: average loss over the minibatches, and average norm of the applied gradients
+        """
+        losses, norms, pending = [], [], 0
+        params = tuple(tf.constant(p, dtype=tf.float32) for p in params)
+        for batch in batches:
+            states, columns = batch[0], tuple(batch[1:-2] if priorities is not None else batch[1:])
+            weights = batch[-2] if priorities is not None else tf.ones(tf.shape(states)[:1])
+            loss, errors = self.get_step(targets, columns, params)(states, columns, weights, params)
+            if priorities is not None: priorities(batch[-1].numpy(), errors.numpy())
+            losses.append(loss)
+            pending += 1
+            if pending == accumulate:
+                norms.append(self.update(pending, on_update=on_update))
+                pending = 0
+        if pending: norms.append(self.update(pending, on_update=on_update))  # Remaining minibatches
+        return {
+            'loss': float(np.mean(losses)) if losses else 0.,
+            'grad norm': float(np.mean(norms)) if norms else 0.,
+        }
+    
+    def update(self, n, on_update=None):
+        """Apply the n accumulated gradients, return the norm of the applied gradient."""
+        norm = self.apply_step(tf.constant(n, dtype=tf.float32))
+        self.updates += 1
+        if on_update is not None: on_update(self.updates)
+        return norm
+    
+    def get_step(self, targets, columns, params=()):
+        """
+        Get the compiled accumulation step of the target function, traced for the layout of the given columns and
+        (scalar) parameters.
+        """
+        if targets not in self.steps:
+            column_specs = tuple(tf.TensorSpec(shape=(None,) + tuple(c.shape[1:]), dtype=c.dtype) for c in columns)
+            weight_spec = tf.TensorSpec(shape=(None,), dtype=tf.float32)
+            param_specs = tuple(tf.TensorSpec(shape=(), dtype=tf.float32) for _ in params)
+            self.steps[targets] = tf.function(lambda s, c, w, p: self._accumulate_step(s, c, w, p, targets=targets),
+                                              input_signature=[self.state_spec, column_specs, weight_spec, param_specs])
+        return self.steps[targets]
+    
+    def _accumulate_step(self, states, columns, weights, params=(), targets=None):
+        """
+        Add the gradients of the minibatch to the accumulated gradients.
+        
+        :return: Tuple: the minibatch's (weighted) loss, and the absolute error of each of its samples (summed over the
+                 masked entries, e.g. the chosen action)
+        """
+        with tf.GradientTape() as tape:
+            predictions = self.model(tf.cast(states, tf.float32), training=True)
+            if targets is None:
+                targets, mask = columns[0], tf.ones_like(predictions)
+            else:
+                targets, mask = targets(tf.stop_gradient(predictions), *columns, *params)
+            loss = tf.reduce_mean(weights * tf.reduce_mean(tf.square(predictions - targets), axis=1))
+        for acc, g in zip(self.gradients, tape.gradient(loss, self.model.trainable_variables)):
+            acc.assign_add(g)
+        return loss, tf.reduce_sum(mask * tf.abs(predictions - targets), axis=1)
+    
+    def _apply_step(self, n):
+        """Apply the average of the n accumulated gradients, return the norm of the applied gradient."""
+        gradients = [acc / n for acc in self.gradients]
+        self.model.optimizer.apply_gradients(zip(gradients, self.model.trainable_variables))
+        for acc in self.gradients: acc.assign(tf.zeros_like(acc))
+        return tf.linalg.global_norm(gradients)
@@ -0,0 +1,57 @@
+"""
+test_dql_agent.py
+
+Tests of the Deep Q-Learning agent's training.
+"""
+import unittest
+
+import numpy as np
+
+from agents.dql_agent import DeepQLearning
+from environment.game import Game
+
+
+class TestDeepQLearning(unittest.TestCase):
+    def play(self, agent, n_envs: int = 2, n_steps: int = 5):
+        """Remember n_steps steps of n_envs (unchanged) games, then train on these as episodes that reached the end."""
+        games = [Game() for _ in range(n_envs)]
+        agent.reset(n_envs=n_envs, sample_game=games[0], max_steps=n_steps)
+        for _ in range(n_steps): agent(games)
+        return agent.train(duration=[n_steps] * n_envs, max_duration=n_steps)
+    
+    def test_lr_change_between_sessions(self):
+        """A changed learning rate is used by the next training session, even though the train step is compiled."""
+        np.random.seed(0)
+        agent = DeepQLearning(model_type='mlp', lr=0.)
+        
+        # Without a learning rate the targets are the predictions themselves
+        self.assertEqual(self.play(agent)['loss'], 0.)
+        
+        # The next session moves the targets towards the discounted scores
+        agent.lr = 0.5
+        self.assertGreater(self.play(agent)['loss'], 0.)
+    
+    def test_gamma_change_between_sessions(self):
+        """The bootstrapped targets use the current discount factor, even though the train step is compiled."""
+        np.random.seed(0)
+        agent = DeepQLearning(model_type='mlp', replay_size=10, target_sync=1000, n_updates=1)
+        game = Game()
+        agent.reset(n_envs=1, sample_game=game, max_steps=1)
+        agent.model.optimizer.learning_rate.assign(0.)  # Keep the weights fixed over the sessions
+        
+        # Single transition without reward of which the state is followed by itself, the chosen action is 1
+        states = game.get_board_relative()[None].astype(np.int8)
+        q = agent.model(states.astype(np.float32)).numpy()[0, 1]
+        q_next = agent.model_target(states.astype(np.float32)).numpy()[0].max()
+        for gamma in (0.9, 0.5):
+            agent.gamma = gamma
+            agent.learn(states=states, actions=np.array([1]), rewards=np.array([0.], dtype=np.float32),
+                        dones=np.array([False]), next_states=states)
+            
+            # The priority of the newest (replayed) transition holds its error
+            error = agent.replay.tree.get(len(agent.replay) - 1) ** (1 / agent.replay.alpha) - 1e-3
+            self.assertAlmostEqual(error, abs(q - gamma * q_next), places=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,14 +13,17 @@ UP = (0, 1)
 # Direction list, sorted clockwise
 DIR = [UP, RIGHT, DOWN, LEFT]
 
+# Precomputed mutations on the directions
+DIR_INDEX = {d: i for i, d in enumerate(DIR)}
+RIGHT_OF = {d: DIR[(i + 1) % len(DIR)] for i, d in enumerate(DIR)}
+LEFT_OF = {d: DIR[(i + len(DIR) - 1) % len(DIR)] for i, d in enumerate(DIR)}
+
 
 def turn_right(d):
     """Get direction when turning to the right."""
-    i = (DIR.index(d) + 1) % len(DIR)
-    return DIR[i]
+    return RIGHT_OF[d]
 
 
 def turn_left(d):
     """Get direction when turning to the left."""
-    i = (DIR.index(d) + (len(DIR) - 1)) % len(DIR)
-    return DIR[i]
+    return LEFT_OF[d]
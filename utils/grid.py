@@ -0,0 +1,22 @@
+"""
+grid.py
+
+Precomputed lookup tables over the flattened cells (x * height + y) of a board.
+"""
+from functools import lru_cache
+
+from utils.direction import DIR
+
+
+@lru_cache(maxsize=None)
+def get_neighbours_table(dim):
+    """
+    Get the neighbours of each cell of the board, sorted like DIR. Walls have no neighbours, and are never a neighbour.
+    
+    :param dim: Dimension of the board (width, height)
+    :return: List containing the list of neighbouring flat indices for each flat cell index
+    """
+    width, height = dim
+    wall = [x in (0, width - 1) or y in (0, height - 1) for x in range(width) for y in range(height)]
+    offsets = [dx * height + dy for dx, dy in DIR]
+    return [[] if wall[c] else [c + o for o in offsets if not wall[c + o]] for c in range(width * height)]
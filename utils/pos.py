@@ -6,13 +6,22 @@ Two dimensional position class.
 
 
 class Pos:
+    __slots__ = ('x', 'y')
+    
     def __init__(self, x=0, y=0, t=None):
         if t:  # Tuple instantiation
-            self.x: int = t[0]
-            self.y: int = t[1]
-        else:  # Variable instantiation
-            self.x: int = x
-            self.y: int = y
+            x, y = t
+        self.x: int = x
+        self.y: int = y
+    
+    @classmethod
+    def from_flat(cls, c: int, height: int):
+        """Create the position encoded by the flat integer c = x * height + y."""
+        return cls(c // height, c % height)
+    
+    def flat(self, height: int):
+        """Encode the position as a single integer, the inverse of from_flat."""
+        return self.x * height + self.y
     
     def __str__(self):
         return f"Pos({self.x}, {self.y})"
@@ -46,49 +55,36 @@ class Pos:
         return 2
     
     def __eq__(self, other):
+        if other.__class__ is Pos: return self.x == other.x and self.y == other.y
         if hasattr(other, "__getitem__") and len(other) == 2:
             return self.x == other[0] and self.y == other[1]
-        else:
-            return False
+        return False
+    
+    def __ne__(self, other):
+        return not self == other
     
     def __lt__(self, other):
+        if other.__class__ is Pos: return self.x < other.x or (self.x == other.x and self.y < other.y)
         if hasattr(other, "__getitem__") and len(other) == 2:
-            if self.x < other[0]:
-                return True
-            elif (self.x == other[0]) and (self.y < other[1]):
-                return True
-            else:
-                return False
-        else:
-            raise TypeError(f"Not possible to use '<' operator on objects {type(self)} and {type(other)}")
+            return self.x < other[0] or (self.x == other[0] and self.y < other[1])
+        raise TypeError(f"Not possible to use '<' operator on objects {type(self)} and {type(other)}")
     
     def __gt__(self, other):
+        if other.__class__ is Pos: return self.x > other.x or (self.x == other.x and self.y > other.y)
         if hasattr(other, "__getitem__") and len(other) == 2:
-            if self.x > other[0]:
-                return True
-            elif (self.x == other[0]) and (self.y > other[1]):
-                return True
-            else:
-                return False
-        else:
-            raise TypeError(f"Not possible to use '>' operator on objects {type(self)} and {type(other)}")
-    
-    def __ne__(self, other):
-        if hasattr(other, "__getitem__") and len(other) == 2:
-            return self.x != other[0] or self.y != other[1]
-        else:
-            return True
+            return self.x > other[0] or (self.x == other[0] and self.y > other[1])
+        raise TypeError(f"Not possible to use '>' operator on objects {type(self)} and {type(other)}")
     
     def __add__(self, other):
         """Add two positions together."""
-        if type(other) in [list, tuple, self.__class__]:
-            return Pos(self.x + other[0], self.y + other[1])
-        else:
-            raise TypeError("Invalid type added to Pos")
+        if other.__class__ is tuple: return Pos(self.x + other[0], self.y + other[1])
+        if other.__class__ is Pos: return Pos(self.x + other.x, self.y + other.y)
+        if other.__class__ is list: return Pos(self.x + other[0], self.y + other[1])
+        raise TypeError("Invalid type added to Pos")
     
     def __sub__(self, other):
         """Subtract the other position from the current position."""
-        if type(other) in [list, tuple, self.__class__]:
-            return Pos(self.x - other[0], self.y - other[1])
-        else:
-            raise TypeError("Invalid type added to Pos")
+        if other.__class__ is tuple: return Pos(self.x - other[0], self.y - other[1])
+        if other.__class__ is Pos: return Pos(self.x - other.x, self.y - other.y)
+        if other.__class__ is list: return Pos(self.x - other[0], self.y - other[1])
+        raise TypeError("Invalid type added to Pos")
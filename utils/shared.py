@@ -0,0 +1,42 @@
+"""
+shared.py
+
+Arrays laid out one after the other in a single block of shared memory, which is handed to the worker processes.
+"""
+import multiprocessing as mp
+
+import numpy as np
+
+
+def get_context():
+    """
+    Get the context in which the worker processes are started. Spawned workers don't inherit the (TensorFlow) state of
+    the main process.
+    """
+    return mp.get_context('spawn')
+
+
+def get_layout(arrays):
+    """
+    Get the offset of each of the arrays in the shared block, each array is aligned to 8 bytes.
+    
+    :param arrays: Sequence of the (dtype, shape) of each array
+    :return: Tuple: list of the (dtype, shape, offset) of each array, and the total size in bytes (at least 1)
+    """
+    layout, offset = [], 0
+    for dtype, shape in arrays:
+        offset = -(-offset // 8) * 8  # Align each of the arrays
+        layout.append((dtype, shape, offset))
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return layout, max(offset, 1)
+
+
+def attach(buf, arrays):
+    """
+    Create the array views on the shared buffer.
+    
+    :param buf: Buffer of the shared memory
+    :param arrays: Sequence of the (dtype, shape) of each array, as used to size the shared memory
+    :return: List of the views, one for each of the arrays
+    """
+    return [np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset) for dtype, shape, offset in get_layout(arrays)[0]]